@@ -0,0 +1,220 @@
+"""A minimal in-memory document, enough for vdom and pydom to mount and update into
+
+Benchmarks use it to measure the Python side of rendering without a browser:
+
+    import fakedom
+    document = fakedom.install()
+    App().render_root()
+
+It does no layout and keeps no styles, so it is only as slow as the bookkeeping
+every DOM has to do, and counts the calls vdom makes in ``Document.mutations``.
+"""
+import os
+import sys
+from html import escape
+from html.parser import HTMLParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "public"))
+
+import backend
+
+VOID_ELEMENTS = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+})
+
+
+class NodeList(list):
+    @property
+    def length(self):
+        return len(self)
+
+    def item(self, index):
+        return self[index] if 0 <= index < len(self) else None
+
+
+class Node:
+    nodeType = 0
+
+    def __init__(self, document):
+        self.ownerDocument = document
+        self.parentNode = None
+        self.childNodes = NodeList()
+
+    def _detach(self, child):
+        self.childNodes.remove(child)
+        child.parentNode = None
+
+    def appendChild(self, child):
+        return self.insertBefore(child, None)
+
+    def insertBefore(self, child, ref):
+        self.ownerDocument.mutations += 1
+        if child.parentNode is not None:
+            child.parentNode._detach(child)
+        if ref is None:
+            self.childNodes.append(child)
+        else:
+            self.childNodes.insert(self.childNodes.index(ref), child)
+        child.parentNode = self
+        return child
+
+    def removeChild(self, child):
+        self.ownerDocument.mutations += 1
+        self._detach(child)
+        return child
+
+    def replaceChild(self, new, old):
+        self.insertBefore(new, old)
+        return self.removeChild(old)
+
+
+class Text(Node):
+    nodeType = 3
+
+    def __init__(self, document, data):
+        super().__init__(document)
+        self.data = data
+
+    @property
+    def textContent(self):
+        return self.data
+
+    @textContent.setter
+    def textContent(self, value):
+        self.ownerDocument.mutations += 1
+        self.data = value
+
+    def to_html(self):
+        return escape(self.data, quote=False)
+
+
+class Element(Node):
+    nodeType = 1
+
+    def __init__(self, document, tag):
+        super().__init__(document)
+        self.tagName = tag.upper()
+        self.attributes = {}
+
+    def setAttribute(self, name, value):
+        self.ownerDocument.mutations += 1
+        self.attributes[name] = str(value)
+
+    def getAttribute(self, name):
+        return self.attributes.get(name)
+
+    def removeAttribute(self, name):
+        self.ownerDocument.mutations += 1
+        self.attributes.pop(name, None)
+
+    def getAttributeNames(self):
+        return list(self.attributes)
+
+    def addEventListener(self, *args):
+        pass
+
+    @property
+    def textContent(self):
+        return "".join(child.textContent for child in self.childNodes)
+
+    @textContent.setter
+    def textContent(self, value):
+        self.ownerDocument.mutations += 1
+        for child in self.childNodes:
+            child.parentNode = None
+        self.childNodes = NodeList()
+        if value:
+            self.appendChild(Text(self.ownerDocument, value))
+
+    @property
+    def innerHTML(self):
+        return "".join(child.to_html() for child in self.childNodes)
+
+    @innerHTML.setter
+    def innerHTML(self, value):
+        self.textContent = ""
+        parser = _Parser(self)
+        parser.feed(value)
+        parser.close()
+
+    def to_html(self):
+        tag = self.tagName.lower()
+        attrs = "".join(f' {name}="{escape(value)}"' for name, value in self.attributes.items())
+        if tag in VOID_ELEMENTS:
+            return f"<{tag}{attrs}>"
+        return f"<{tag}{attrs}>{self.innerHTML}</{tag}>"
+
+    def iter(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(child for child in reversed(node.childNodes) if child.nodeType == Element.nodeType)
+
+
+class _Parser(HTMLParser):
+    """Builds nodes straight into an element, like assigning innerHTML would"""
+
+    def __init__(self, root):
+        super().__init__(convert_charrefs=True)
+        self.document = root.ownerDocument
+        self.stack = [root]
+
+    def _add(self, node):
+        parent = self.stack[-1]
+        parent.childNodes.append(node)
+        node.parentNode = parent
+
+    def handle_starttag(self, tag, attrs):
+        element = Element(self.document, tag)
+        element.attributes = {name: value or "" for name, value in attrs}
+        self._add(element)
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(element)
+
+    def handle_endtag(self, tag):
+        if len(self.stack) > 1:
+            self.stack.pop()
+
+    def handle_data(self, data):
+        children = self.stack[-1].childNodes
+        if children and children[-1].nodeType == Text.nodeType:
+            children[-1].data += data
+        else:
+            self._add(Text(self.document, data))
+
+
+class Document:
+    def __init__(self):
+        self.mutations = 0
+        self.body = Element(self, "body")
+        root = self.body.appendChild(Element(self, "div"))
+        root.attributes["id"] = "root"
+        self.mutations = 0
+
+    def createElement(self, tag):
+        return Element(self, tag)
+
+    def createTextNode(self, data):
+        return Text(self, data)
+
+    def getElementById(self, ident):
+        for element in self.body.iter():
+            if element.attributes.get("id") == ident:
+                return element
+        return None
+
+
+class FakeBackend(backend.Backend):
+    """Renders into a fresh ``Document``, updates only flush on ``scheduler.flush_sync``"""
+
+    def __init__(self):
+        self.document = Document()
+
+
+def install() -> Document:
+    """Makes pydom render into a new fake document, and returns it"""
+    fake = FakeBackend()
+    backend.set_backend(fake)
+    return fake.document
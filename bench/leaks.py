@@ -0,0 +1,67 @@
+"""Checks that re-rendering doesn't leak event handlers, exits with status 1 if it does
+
+    python bench/leaks.py [--renders renders]
+
+A parent constructing its child Elements anew on every render is re-rendered
+over and over, the handlers registered for the children it threw away must be
+released, so the number of live handlers stays the same.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "public"))
+
+import fakedom
+import scheduler
+from pydom import Element, a, div
+from tinyhtml import callbacks
+
+
+class Child(Element):
+    clicks = 0
+
+    def click(self):
+        self.clicks += 1
+
+    def build_children(self, props):
+        self.children = [a(onclick=lambda: self.click)("Click"), a(onmouseover=lambda: self.click)("Hover")]
+
+
+class Parent(Element):
+    renders = 0
+
+    def rerender(self):
+        self.renders += 1
+
+    def build_children(self, props):
+        self.children = [
+            div(onclick=lambda: self.rerender)(lambda: str(self.renders)),
+            # Not memoized, new Child instances every render
+            lambda: [Child(), Child()],
+        ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--renders", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    fakedom.install()
+    parent = Parent()
+    parent.render_root()
+    live = [callbacks.stats()["live"]]
+    for _ in range(args.renders):
+        parent.renders += 1
+        scheduler.flush_sync()
+        live.append(callbacks.stats()["live"])
+
+    print(f"live handlers over {args.renders} re-renders: {live[0]} -> {live[-1]}, {callbacks.stats()}")
+    if len(set(live)) != 1:
+        print(f"handlers leaked: {live}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
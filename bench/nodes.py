@@ -0,0 +1,119 @@
+"""Compares the size and construction time of tinyhtml nodes with the representation they replaced
+
+    python bench/nodes.py [-n repeats] [--rows rows]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "public"))
+
+from pydom import div, span, a
+from tinyhtml import Frag, h, render
+
+
+class dict_h(Frag):
+    """tinyhtml.h as it was, an instance __dict__ and an attrs dict on every tag"""
+
+    def __init__(self, __name, **attrs):
+        if not (__name and __name.isascii() and __name.isalnum()):
+            raise ValueError(f"invalid html tag: {__name!r}")
+        self.name = __name
+        self.attrs = attrs
+
+    def __call__(self, *children):
+        return dict_h_children(self, children)
+
+    def render_into(self, builder):
+        raise NotImplementedError
+
+
+class dict_h_children(Frag):
+    def __init__(self, tag, children):
+        self.tag = tag
+        self.children = children
+
+    def render_into(self, builder):
+        raise NotImplementedError
+
+
+class BuiltinElement(dict_h):
+    def __new__(cls, __name, **attrs):
+        return dict_h(__name, **attrs)
+
+
+old_div = partial(BuiltinElement, "div")
+old_span = partial(BuiltinElement, "span")
+old_a = partial(BuiltinElement, "a")
+
+
+def table(rows, div, span, a):
+    """The rows of a typical table, a mix of tags without, with one and with several attributes"""
+    return div(_class="table")([
+        div(_class="row", key=i)(
+            span()(f"Row {i}"),
+            span(_class="value")(str(i * 3)),
+            a(href=f"/rows/{i}", _class="link", title="Open")("Open"),
+        )
+        for i in range(rows)
+    ])
+
+
+def count_nodes(tree):
+    stack, nodes = [tree], 0
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif hasattr(node, "children"):
+            nodes += 2  # The tag and the node holding its children
+            stack.extend(node.children)
+    return nodes
+
+
+def allocated(func):
+    tracemalloc.start()
+    try:
+        result = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def best_of(repeats, func):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--repeats", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    print(f"a table of {args.rows} rows, best of {args.repeats}")
+    print(f"  {'':<28}{'bytes/node':>12}{'build ms':>12}")
+    cases = [
+        ("dict attrs, partial", (old_div, old_span, old_a)),
+        ("slots, tag_factory", (div, span, a)),
+        ("slots, h(name)", tuple(partial(h, name) for name in ("div", "span", "a"))),
+    ]
+    for name, factories in cases:
+        tree, size = allocated(lambda: table(args.rows, *factories))
+        elapsed = best_of(args.repeats, lambda: table(args.rows, *factories))
+        print(f"  {name:<28}{size / count_nodes(tree):12.1f}{elapsed * 1000:12.2f}")
+
+    tree = table(args.rows, div, span, a)
+    print(f"  {'render, slots':<28}{'':>12}{best_of(args.repeats, lambda: render(tree)) * 1000:12.2f}")
+
+
+if __name__ == '__main__':
+    main()
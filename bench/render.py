@@ -0,0 +1,94 @@
+"""Compares tinyhtml's renderer with the recursive one it replaced, on deep and wide trees
+
+    python bench/render.py [-n repeats]
+"""
+import argparse
+import os
+import sys
+import time
+from html import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "public"))
+
+from tinyhtml import Frag, _h, h, render, render_iter
+
+
+def recursive_render_into(frag, builder):
+    """tinyhtml.render_into as it was, one Python frame per node"""
+    if callable(frag):
+        frag = frag()
+    if frag is None:
+        return
+    elif isinstance(frag, str):
+        builder.append(escape(frag, quote=False))
+    elif isinstance(frag, _h):
+        frag.tag.render_into(builder)
+        for child in frag.children:
+            recursive_render_into(child, builder)
+        builder.append(f"</{frag.tag.name}>")
+    elif isinstance(frag, Frag):
+        frag.render_into(builder)
+    elif hasattr(frag, "__iter__"):
+        for child in frag:
+            recursive_render_into(child, builder)
+    else:
+        builder.append(escape(str(frag), quote=False))
+
+
+def recursive_render(frag):
+    builder = []
+    recursive_render_into(frag, builder)
+    return "".join(builder)
+
+
+def deep(depth):
+    tree = "leaf"
+    for i in range(depth):
+        tree = h("div", _class=f"level-{i % 10}")(tree)
+    return tree
+
+
+def wide(width):
+    return h("ul")([h("li", _class="item")(h("span")(f"item {i}"), " & more") for i in range(width)])
+
+
+def best_of(repeats, func):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--repeats", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    cases = [
+        ("deep, 200 levels", deep(200)),
+        ("deep, 5000 levels", deep(5000)),
+        ("wide, 100 items", wide(100)),
+        ("wide, 10000 items", wide(10000)),
+    ]
+    renderers = [
+        ("recursive", recursive_render),
+        ("render", render),
+        ("render_iter", lambda tree: sum(len(chunk) for chunk in render_iter(tree))),
+    ]
+
+    print(f"best of {args.repeats}, ms")
+    print(f"  {'':<20}" + "".join(f"{name:>14}" for name, _ in renderers))
+    for case, tree in cases:
+        row = []
+        for _, renderer in renderers:
+            try:
+                row.append(f"{best_of(args.repeats, lambda: renderer(tree)) * 1000:14.2f}")
+            except RecursionError:
+                row.append(f"{'RecursionError':>14}")
+        print(f"  {case:<20}" + "".join(row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""Benchmarks every stage from .pyx source to the document, and compares runs
+
+    python bench/suite.py [-n repeats] [-k filter] [--json results.json]
+    python bench/suite.py --compare baseline.json [--threshold 0.2]
+
+Each benchmark reports the best and median time of one call over ``repeats``
+samples. ``--json`` writes them out along with the versions they were measured
+on, ``--compare`` reads such a file back and exits with status 1 if anything got
+slower than the baseline by more than ``--threshold``.
+"""
+import argparse
+import ast
+import importlib
+import json
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, NamedTuple, Optional
+
+ROOT = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "src" / "public"))
+
+import lark
+
+import fakedom
+import pydom
+import scheduler
+from pydom import Element, div, h1, span
+from pydom_parser import cache
+from pydom_parser.ast_transformer import StaticMarkup, transformer, unparse
+from pydom_parser.python_parser import get_parser
+from tinyhtml import h, render
+
+SAMPLE = ROOT / "src" / "app.pyx"
+
+# Samples of a fast benchmark loop over the function until they take at least this long
+MIN_SAMPLE_TIME = 0.005
+
+
+class Benchmark(NamedTuple):
+    name: str
+    func: Callable
+    # Called before every sample when given, which then only runs ``func`` once
+    setup: Optional[Callable] = None
+
+
+def measure(benchmark: Benchmark, repeats: int) -> dict:
+    number = 1
+    if benchmark.setup is None:
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                benchmark.func()
+            if time.perf_counter() - start >= MIN_SAMPLE_TIME:
+                break
+            number *= 2
+
+    samples = []
+    for _ in range(repeats):
+        if benchmark.setup is not None:
+            benchmark.setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            benchmark.func()
+        samples.append((time.perf_counter() - start) / number)
+    return {"best": min(samples), "median": statistics.median(samples), "number": number}
+
+
+#
+#   Transpiling
+#
+
+
+def generate_pyx(components: int) -> str:
+    """A module of ``components`` elements, each with static and dynamic markup"""
+    parts = ["from pydom import Element, div, a, span, p\n"]
+    for i in range(components):
+        parts.append(f'''
+
+class Component{i}(Element):
+    count = {i}
+
+    def increment(self):
+        self.count += 1
+
+    def build_children(self, props):
+        self.children = [
+            <div class="card">
+                <span class={{f"title-{{self.count}}"}}>{{props.get("title")}}</span>
+                <p class="body">{{"Some static text, to be compiled ahead of time."}}</p>
+                <a onclick={{self.increment}} class="btn">{{f"Clicked {{self.count}} times"}}</a>
+            </div>
+        ]
+''')
+    return "".join(parts)
+
+
+def transform(tree):
+    """What ``pydom_parser.parse`` does after lark is done"""
+    return ast.fix_missing_locations(StaticMarkup.apply(transformer.transform(tree)))
+
+
+def transpile_benchmarks():
+    import autopep8
+
+    sources = [("app", SAMPLE.read_text() + "\n"), ("generated-50", generate_pyx(50))]
+    parser = get_parser()
+    for name, source in sources:
+        tree = parser.parse(source)
+        module = transform(tree)
+        python = unparse(module)
+        yield Benchmark(f"parse/{name}", lambda source=source: parser.parse(source))
+        yield Benchmark(f"transform/{name}", lambda tree=tree: transform(tree))
+        yield Benchmark(f"unparse/{name}", lambda module=module: unparse(module))
+        yield Benchmark(f"autopep8/{name}", lambda python=python: autopep8.fix_code(python))
+
+
+def import_benchmarks(directory):
+    """Importing a .pyx module through the path hook, with and without its bytecode cached"""
+    module = "pyx_bench_module"
+    source = pathlib.Path(directory) / f"{module}.pyx"
+    source.write_text(generate_pyx(50))
+    cache.set_cache_dir(pathlib.Path(directory) / "cache")
+    sys.path.insert(0, str(directory))
+    importlib.invalidate_caches()
+
+    def forget():
+        sys.modules.pop(module, None)
+
+    def cold():
+        forget()
+        pathlib.Path(cache.cache_path(source)).unlink(missing_ok=True)
+
+    # Otherwise nothing is cached, and warm imports are cold ones (PYTHONDONTWRITEBYTECODE)
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.dont_write_bytecode = False
+    try:
+        yield Benchmark("import/cold", lambda: importlib.import_module(module), cold)
+        yield Benchmark("import/warm", lambda: importlib.import_module(module), forget)
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+
+
+#
+#   Rendering
+#
+
+
+def tree(depth: int, width: int):
+    """``width`` children on each of ``depth`` levels, with text at the leaves"""
+    if depth == 0:
+        return "leaf & text"
+    return h("div", _class=f"level-{depth}")([tree(depth - 1, width) for _ in range(width)])
+
+
+def deep(depth: int):
+    node = "leaf"
+    for i in range(depth):
+        node = h("div", _class=f"level-{i % 10}")(node)
+    return node
+
+
+def render_benchmarks():
+    trees = [
+        ("tree-4x8", tree(4, 8)),
+        ("tree-8x3", tree(8, 3)),
+        ("deep-1000", deep(1000)),
+        ("wide-5000", tree(1, 5000)),
+    ]
+    for name, node in trees:
+        yield Benchmark(f"render/{name}", lambda node=node: render(node))
+
+
+class Row(Element):
+    count = 0
+
+    def build_children(self, props):
+        self.children = [
+            div(_class="row")(span(_class="label")(props.get("label")), span()(lambda: str(self.count)))
+        ]
+
+
+class Table(Element):
+    title = "Rows"
+
+    def build_children(self, props):
+        self.rows = [Row(label=f"Row {i}") for i in range(props.get("rows"))]
+        self.children = [div(_class="table")(h1()(lambda: self.title), div()(self.rows))]
+
+
+def update_benchmarks(rows: int = 200):
+    """Element update cycles, from changing state to the fake document being patched"""
+    state = {}
+
+    def mount():
+        fakedom.install()
+        state["table"] = Table(rows=rows)
+
+    def mounted():
+        mount()
+        state["table"].render_root()
+
+    def one_row():
+        state["table"].rows[rows // 2].count += 1
+        scheduler.flush_sync()
+
+    def parent():
+        table = state["table"]
+        table.title = "Rows" if table.title != "Rows" else "Other rows"
+        scheduler.flush_sync()
+
+    def every_row():
+        with pydom.batch():
+            for row in state["table"].rows:
+                row.count += 1
+
+    yield Benchmark(f"update/mount-{rows}", lambda: state["table"].render_root(), mount)
+    yield Benchmark(f"update/one-row-of-{rows}", one_row, mounted)
+    yield Benchmark(f"update/parent-of-{rows}", parent, mounted)
+    yield Benchmark(f"update/every-row-of-{rows}", every_row, mounted)
+
+
+#
+#   Comparing runs
+#
+
+
+def metadata(repeats: int) -> dict:
+    return {
+        "python": platform.python_version(),
+        "implementation": sys.implementation.cache_tag,
+        "platform": platform.platform(),
+        "lark": lark.__version__,
+        "repeats": repeats,
+    }
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> bool:
+    """Prints how ``results`` moved from ``baseline``, returns False if anything regressed"""
+    ok = True
+    print(f"compared to {baseline['meta']['python']} on {baseline['meta']['platform']}, best of each")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"  {name:<28} {'new':>10}")
+            continue
+        ratio = result["best"] / before["best"]
+        regressed = ratio > 1 + threshold
+        ok &= not regressed
+        print(f"  {name:<28} {before['best'] * 1000:10.3f} {result['best'] * 1000:10.3f} ms  {ratio:6.2f}x"
+              + ("  REGRESSED" if regressed else ""))
+    for name in sorted(baseline["results"].keys() - results.keys()):
+        print(f"  {name:<28} {'missing':>10}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--repeats", type=int, default=10)
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results of an earlier --json run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="how much slower than the baseline counts as a regression, 0.2 being 20%%")
+    args = parser.parse_args(argv)
+
+    get_parser()  # Not part of what's measured
+    results = {}
+    cache_dir = cache.cache_dir
+    with tempfile.TemporaryDirectory() as directory:
+        groups = [transpile_benchmarks(), import_benchmarks(directory), render_benchmarks(), update_benchmarks()]
+        print(f"best and median of {args.repeats}, ms")
+        for group in groups:
+            for benchmark in group:
+                if args.filter not in benchmark.name:
+                    continue
+                result = measure(benchmark, args.repeats)
+                results[benchmark.name] = result
+                print(f"  {benchmark.name:<28} {result['best'] * 1000:10.3f} {result['median'] * 1000:10.3f}")
+        cache.set_cache_dir(cache_dir)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"meta": metadata(args.repeats), "results": results}, file, indent=2)
+            file.write("\n")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        baseline["results"] = {name: result for name, result in baseline["results"].items() if args.filter in name}
+        if not compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
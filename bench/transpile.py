@@ -0,0 +1,58 @@
+"""Compares the transpiler output modes on the sample app
+
+    python bench/transpile.py [path/to/file.pyx] [-n repeats]
+"""
+import argparse
+import os
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pydom_parser import cache, parse
+from pydom_parser.ast_transformer import transpile, unparse
+from pydom_parser.python_parser import get_parser
+
+SAMPLE = pathlib.Path(__file__).parent.parent / "src" / "app.pyx"
+
+
+def best_of(repeats, func):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?", default=SAMPLE)
+    parser.add_argument("-n", "--repeats", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with open(args.path, 'rb') as file:
+        data = file.read()
+    source = data.decode()
+    get_parser()  # Not part of what's measured
+
+    tree = parse(source)
+    modes = [
+        ("parse only", lambda: parse(source)),
+        ("formatted (autopep8)", lambda: transpile(source)),
+        ("release (unparse)", lambda: transpile(source, format=False)),
+        ("bytecode (.pyc)", lambda: cache.pyc_bytes(cache.compile_source(data, "<bench>"), cache.source_hash(data))),
+        ("unparse alone", lambda: unparse(tree)),
+    ]
+
+    print(f"{args.path}, best of {args.repeats}")
+    baseline = None
+    for name, func in modes:
+        elapsed = best_of(args.repeats, func)
+        baseline = baseline or elapsed
+        print(f"  {name:<22} {elapsed * 1000:8.2f} ms  {elapsed / baseline:6.1f}x parse")
+
+
+if __name__ == '__main__':
+    main()
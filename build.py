@@ -1,18 +1,78 @@
-import os
-import pathlib
-from distutils.dir_util import copy_tree
+import argparse
+import sys
 
-from pydom_parser.ast_transformer import transpile_file
+from pydom_parser import instrument
+from pydom_parser.builder import build
+from pydom_parser.prerender import prerender
+from pydom_parser.watch import watch
 
-build_dir = pathlib.Path("build")
-if not build_dir.is_dir():
-    build_dir.mkdir()
 
-src_dir = pathlib.Path("src")
-public_dir = src_dir / "public"
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Builds a py-dom project, only rebuilding what changed")
+    parser.add_argument("--src", default="src", help="source folder (default: src)")
+    parser.add_argument("--out", default="build", help="build folder (default: build)")
+    parser.add_argument("--public", default=None, help="folder copied as is (default: <src>/public)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="transpiler processes (default: one per CPU, 1 transpiles in this process)")
+    parser.add_argument("-f", "--force", action="store_true", help="rebuild everything")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every output and its build time")
+    parser.add_argument("-r", "--release", action="store_true",
+                        help="skip formatting the transpiled output with autopep8, much faster")
+    parser.add_argument("--bytecode", action="store_true",
+                        help="write .pyc files instead of transpiled source, for the Python version running this")
+    parser.add_argument("--prerender", action="store_true",
+                        help="render the app into index.html, for it to show before Pyodide is loaded")
+    parser.add_argument("--bundle", action="store_true",
+                        help="also zip the Python files of the build, for py-dom.js to fetch at once")
+    parser.add_argument("--pyc-bundle", action="store_true",
+                        help="also compile the build into a zip of bytecode for zipimport, run this on the "
+                             "Python version of Pyodide")
+    parser.add_argument("--timings", action="store_true",
+                        help="print the time spent in each stage of transpiling, over every file built")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="save a cProfile capture of transpiling each file into DIR")
+    parser.add_argument("-w", "--watch", action="store_true", help="keep rebuilding as sources change")
+    parser.add_argument("--poll", action="store_true", help="watch by polling instead of inotify")
+    args = parser.parse_args(argv)
 
-copy_tree(str(public_dir), str(build_dir))
+    if args.profile:
+        instrument.profile_dir = args.profile
 
-for file in os.listdir("src"):
-    if file.endswith(".pyx"):
-        transpile_file(src_dir / file, build_dir / file[:-1])
+    if args.watch:
+        watch(args.src, args.out, public_dir=args.public, poll=args.poll, jobs=args.jobs, format=not args.release,
+              bytecode=args.bytecode, bundle=args.bundle, pyc_bundle=args.pyc_bundle,
+              timings=args.timings)
+        return 0
+
+    totals = instrument.StageTotals()
+    if args.timings:
+        instrument.add_observer(totals)
+
+    result = build(args.src, args.out, public_dir=args.public, jobs=args.jobs, force=args.force,
+                   format=not args.release, bytecode=args.bytecode, bundle=args.bundle,
+                   pyc_bundle=args.pyc_bundle)
+
+    if args.verbose:
+        for output in result.built:
+            print(f"  built {output} ({result.timings[output] * 1000:.1f} ms)")
+        for output in result.removed:
+            print(f"  removed {output}")
+    if args.timings and totals.counts:
+        print(f"stages over {len(totals.files)} files:")
+        print(totals.summary())
+    for output, error in result.errors.items():
+        print(f"  failed {output}: {error!r}", file=sys.stderr)
+    print(f"{len(result.built)} built, {len(result.skipped)} up to date, {len(result.removed)} removed, "
+          f"{len(result.errors)} failed in {result.elapsed:.2f}s")
+    if not result.ok:
+        return 1
+
+    if args.prerender:
+        print(f"prerendered {prerender(args.src, args.out, public_dir=args.public)}")
+    for output in result.bundles:
+        print(f"bundled {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,10 @@
-from .ast_transformer import parser
+from .ast_transformer import parse, transpile, transpile_file
 from .import_handler import *
+from .python_parser import get_parser
+
+
+def __getattr__(name):
+    # The parser is only built when first needed, see python_parser.get_parser
+    if name == 'parser':
+        return get_parser()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,12 +1,12 @@
 import ast
 import itertools
 import sys
+from html import escape
 
-import astunparse
-import autopep8
 from lark import ast_utils, Transformer, Token
 
-from .python_parser import chosen_parser
+from . import instrument
+from .python_parser import get_parser
 
 this_module = sys.modules[__name__]
 
@@ -17,6 +17,9 @@ this_module = sys.modules[__name__]
 
 DEBUG = False
 
+# Bump whenever ToAst changes the code it generates, invalidating cached bytecode
+TRANSFORMER_VERSION = 5
+
 
 def debug(*args, **kwargs):
     if DEBUG:
@@ -45,6 +48,15 @@ class ToAst(Transformer):
         debug('string', s)
         return ast.parse(s[0].value, mode='eval').body
 
+    def const_true(self, s):
+        return ast.Constant(True)
+
+    def const_false(self, s):
+        return ast.Constant(False)
+
+    def const_none(self, s):
+        return ast.Constant(None)
+
     def string_concat(self, s):
         debug('string', s)
         s[0].value += s[1].value
@@ -96,10 +108,7 @@ class ToAst(Transformer):
         if len(s) == 1:
             result = ast.Call(ast.Name(s[0], ast.Load()), [], [])
         elif len(s) == 2:
-            if (
-                    s[1] and
-                    not isinstance(s[1][0], list)
-            ):
+            if s[1] and not isinstance(s[1], list):
                 s[1] = [s[1]]
             result = ast.Call(ast.Name(s[0], ast.Load()), [], create_keywords(s[1]))
 
@@ -178,9 +187,16 @@ class ToAst(Transformer):
         debug("module", s)
         return ast.Module(s, [])
 
+    def dots(self, s):
+        debug("dots", s)
+        return sum(len(dot) for dot in s)
+
     def import_from(self, s):
         debug("Import from", s)
-        return ast.ImportFrom(s[0], s[1], 0)
+        level = s.pop(0) if isinstance(s[0], int) else 0
+        module = s.pop(0) if s and isinstance(s[0], str) else None
+        names = s[0] if s else [ast.alias("*", None)]  # from x import *
+        return ast.ImportFrom(module, names, level)
 
     def import_stmt(self, s):
         debug("Import", s)
@@ -191,7 +207,7 @@ class ToAst(Transformer):
 
     def dotted_name(self, s):
         debug("dotted name", s)
-        return s[0]
+        return ".".join(s)
 
     def import_as_names(self, s):
         debug("as names", s)
@@ -248,6 +264,61 @@ class ToAst(Transformer):
         debug("funcdef", s)
         return ast.FunctionDef(s[0], s[1], s[3], s[2] or [], None, None)
 
+    def async_funcdef(self, s):
+        debug("async funcdef", s)
+        func = s[0]
+        return ast.AsyncFunctionDef(func.name, func.args, func.body, func.decorator_list, func.returns, None)
+
+    def async_stmt(self, s):
+        debug("async", s)
+        node = s[0]
+        if isinstance(node, ast.For):
+            return ast.AsyncFor(node.target, node.iter, node.body, node.orelse, None)
+        if isinstance(node, ast.With):
+            return ast.AsyncWith(node.items, node.body, None)
+        return self.async_funcdef(s)
+
+    @staticmethod
+    def _load(node):
+        return ast.Name(node, ast.Load()) if isinstance(node, str) else node
+
+    @staticmethod
+    def _store(node):
+        if isinstance(node, str):
+            return ast.Name(node, ast.Store())
+        if isinstance(node, (ast.Attribute, ast.Subscript, ast.List, ast.Tuple, ast.Name)):
+            node.ctx = ast.Store()
+            if isinstance(node, (ast.List, ast.Tuple)):
+                node.elts = [ToAst._store(elt) for elt in node.elts]
+        return node
+
+    def exprlist(self, s):
+        return ast.Tuple([self._load(item) for item in s], ast.Load())
+
+    testlist_tuple = exprlist
+
+    def for_stmt(self, s):
+        debug("for", s)
+        target, iterable, body, orelse = s
+        return ast.For(self._store(target), self._load(iterable), body, orelse or [], None)
+
+    def with_item(self, s):
+        debug("with item", s)
+        expr, name = s
+        return ast.withitem(self._load(expr), None if name is None else ast.Name(name, ast.Store()))
+
+    def with_items(self, s):
+        return s
+
+    def with_stmt(self, s):
+        debug("with", s)
+        items, body = s
+        return ast.With(items, body, None)
+
+    def await_expr(self, s):
+        debug("await", s)
+        return ast.Await(ast.Name(s[1], ast.Load()) if isinstance(s[1], str) else s[1])
+
     def starparams(self, s):
         debug("starparams", s)
         return [s[0]] + s[1]
@@ -336,7 +407,13 @@ class ToAst(Transformer):
 
     def decorator(self, s):
         debug("decorator", s)
-        return (ast.Name(s[0], ast.Load()) if isinstance(s[0], str) else s[0])
+        if not isinstance(s[0], str):
+            return s[0]
+        first, *attrs = s[0].split(".")
+        node = ast.Name(first, ast.Load())
+        for attr in attrs:
+            node = ast.Attribute(node, attr, ast.Load())
+        return node
 
     def decorators(self, s):
         debug("decorators", s)
@@ -369,29 +446,237 @@ class ToAst(Transformer):
 
 
 #
-#   Define Parser
+#   Compile static markup
 #
 
-parser = chosen_parser
+# Whether tags of standard HTML elements with constant attributes are compiled to
+# markup ahead of time, rather than built into tinyhtml trees on every render
+COMPILE_STATIC = True
+
+HTML_TAGS = frozenset("""
+    a abbr address area article aside audio b base bdi bdo blockquote body br button canvas caption cite code col
+    colgroup data datalist dd del details dfn dialog div dl dt em embed fieldset figcaption figure footer form h1 h2
+    h3 h4 h5 h6 head header hgroup hr i iframe img input ins kbd label legend li link main map mark menu meta meter
+    nav noscript object ol optgroup option output p param picture pre progress q rp rt ruby s samp script section
+    select slot small source span strong style sub summary sup table tbody td template textarea tfoot th thead time
+    title tr track u ul var video wbr
+""".split())
+
+VOID_TAGS = frozenset({"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source",
+                       "track", "wbr"})
+
+# What the tinyhtml classes are imported as in compiled modules
+RAW_NAME = "_pyx_raw"
+TEMPLATE_NAME = "_pyx_template"
+_IMPORTED = {RAW_NAME: "raw", TEMPLATE_NAME: "template"}
+
+
+def static_attr(attr, value):
+    """Renders a constant attribute the way tinyhtml would, None if it can only be rendered at runtime"""
+    if attr in ("klass", "_class"):
+        attr = "class"
+    elif "_" in attr:
+        attr = attr.rstrip("_").replace("_", "-")
+    # Keys are needed at runtime to diff, and styles are serialized by tinyhtml.convert_style
+    if attr in ("key", "style"):
+        return None
+    if not (attr and attr.isascii() and all(ch.isalnum() or ch == "-" for ch in attr)):
+        return None  # Let it fail at runtime, as it always did
+
+    if value is False or value is None:
+        return ""
+    elif value is True:
+        value = ""
+    elif isinstance(value, (str, int, float)):
+        value = str(value)
+    else:
+        return None
+    if not value:
+        return f" {attr}"
+    return f" {attr}=\"" + escape(value, quote=False).replace("\"", "&quot;") + "\""
+
+
+class StaticMarkup(ast.NodeTransformer):
+    """Replaces tags whose markup is known ahead of time with the markup itself
+
+    Fully static subtrees become ``raw(markup)``, and subtrees with dynamic
+    children become a ``template`` of static chunks around slots for those
+    children. Tags named after HTML elements are assumed to be those elements,
+    unless the module binds the name to something else, anywhere in it, and
+    nothing is compiled when a star import may bind any name.
+    """
+
+    def __init__(self, shadowed):
+        self.shadowed = shadowed
+        self.used = set()
+
+    @classmethod
+    def apply(cls, module):
+        shadowed = cls.bound_names(module)
+        if shadowed is None:
+            return module
+        transformer = cls(shadowed)
+        module = transformer.visit(module)
+        if transformer.used:
+            names = [ast.alias(_IMPORTED[name], name) for name in sorted(transformer.used)]
+            body = module.body
+            # After the docstring and __future__ imports, which have to come first
+            index = 0
+            while index < len(body) and (
+                    isinstance(body[index], ast.ImportFrom) and body[index].module == "__future__" or
+                    index == 0 and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant)
+            ):
+                index += 1
+            body.insert(index, ast.ImportFrom("tinyhtml", names, 0))
+        return module
+
+    @staticmethod
+    def bound_names(module):
+        """Every name bound in ``module``, in any scope, None if it star imports from anything but pydom"""
+        names = set()
+        for node in ast.walk(module):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                names.add(node.name)
+            elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                names.add(node.id)
+            elif isinstance(node, ast.arg):
+                names.add(node.arg)
+            elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)) and node.name:
+                names.add(node.name)
+            elif isinstance(node, ast.MatchMapping) and node.rest:
+                names.add(node.rest)
+            elif isinstance(node, ast.Import):
+                names.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module != "pydom":
+                if any(alias.name == "*" for alias in node.names):
+                    return None
+                names.update(alias.asname or alias.name for alias in node.names)
+        return names
+
+    def markup(self, node):
+        """The markup of a tag as strings and slot expressions, None if it isn't static"""
+        if not getattr(node, "is_htmltag", False):
+            return None
+        if isinstance(node.func, ast.Call):
+            tag, children = node.func, node.args
+        else:
+            tag, children = node, None
+        if not isinstance(tag.func, ast.Name) or tag.args:
+            return None
+        name = tag.func.id
+        if name not in HTML_TAGS or name in self.shadowed:
+            return None
+
+        parts = [f"<{name}"]
+        for keyword in tag.keywords:
+            if keyword.arg is None or not isinstance(keyword.value, ast.Constant):
+                return None
+            attr = static_attr(keyword.arg, keyword.value.value)
+            if attr is None:
+                return None
+            parts.append(attr)
+        parts.append(">")
+        if name in VOID_TAGS and not children:
+            return parts
+
+        for child in children or ():
+            if isinstance(child, ast.Constant) and not isinstance(child.value, bytes):
+                if child.value is not None:
+                    parts.append(escape(str(child.value), quote=False))
+                continue
+            child_parts = self.markup(child)
+            if child_parts is None:
+                parts.append(self.visit(child))
+            else:
+                parts.extend(child_parts)
+        parts.append(f"</{name}>")
+        return parts
+
+    def visit_Call(self, node):
+        parts = self.markup(node)
+        if parts is None:
+            return self.generic_visit(node)
+
+        chunks, slots = [""], []
+        for part in parts:
+            if isinstance(part, str):
+                chunks[-1] += part
+            else:
+                slots.append(part)
+                chunks.append("")
+        if not slots:
+            self.used.add(RAW_NAME)
+            return ast.Call(ast.Name(RAW_NAME, ast.Load()), [ast.Constant(chunks[0])], [])
+        self.used.add(TEMPLATE_NAME)
+        return ast.Call(
+            ast.Name(TEMPLATE_NAME, ast.Load()),
+            [ast.Tuple([ast.Constant(chunk) for chunk in chunks], ast.Load()), ast.Tuple(slots, ast.Load())],
+            []
+        )
+
+
+#
+#   Define Parser
+#
 
 transformer = ast_utils.create_transformer(this_module, ToAst())
 
 
-def parse(text):
-    tree = parser.parse(text)
-    transformed = transformer.transform(tree)
-    ast.fix_missing_locations(transformed)
+def __getattr__(name):
+    # The parser is built lazily, so that imports served from the bytecode cache never need it
+    if name == 'parser':
+        return get_parser()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def parse(text, filename=None):
+    """Parses pyx source into a Python ``ast.Module``, ``filename`` is only used to report stages"""
+    parser = get_parser()  # Built on first use, which isn't part of parsing this file
+    with instrument.stage("parse", filename) as info:
+        tree = parser.parse(text)
+        if info is not None:
+            info["tokens"] = sum(1 for _ in tree.scan_values(lambda value: isinstance(value, Token)))
+    with instrument.stage("transform", filename) as info:
+        transformed = transformer.transform(tree)
+        if info is not None:
+            info["nodes"] = sum(1 for _ in ast.walk(transformed))
+    if COMPILE_STATIC:
+        with instrument.stage("static", filename):
+            transformed = StaticMarkup.apply(transformed)
+    with instrument.stage("fix_locations", filename):
+        ast.fix_missing_locations(transformed)
     return transformed
 
 
-def transpile(source):
-    tree = parse(source)
-    ast.fix_missing_locations(tree)
-    formatted = autopep8.fix_code(astunparse.unparse(tree))
-    return formatted
+def unparse(tree):
+    """Turns a tree back into source, with ``ast.unparse`` where available (3.9+)"""
+    if hasattr(ast, "unparse"):
+        return ast.unparse(tree) + "\n"
+    import astunparse
+    return astunparse.unparse(tree)
+
+
+def transpile(source, format=True, filename=None):
+    """Transpiles pyx source to Python source
+
+    ``format`` runs the output through autopep8, which makes it easier to read but
+    takes most of the time spent transpiling. Release builds turn it off.
+    """
+    tree = parse(source, filename)
+    if not format:
+        with instrument.stage("unparse", filename):
+            return unparse(tree)
+
+    # Only imported for formatted builds, release builds never need them
+    import astunparse
+    import autopep8
+    with instrument.stage("unparse", filename):
+        python = astunparse.unparse(tree)
+    with instrument.stage("format", filename):
+        return autopep8.fix_code(python)
 
 
-def transpile_file(path, output_path):
-    with open(path, 'r') as inputfile:
+def transpile_file(path, output_path, format=True):
+    with open(path, 'r') as inputfile, instrument.profiled(path):
         with open(output_path, 'w') as outputfile:
-            outputfile.write(transpile(inputfile.read()))
+            outputfile.write(transpile(inputfile.read(), format=format, filename=path))
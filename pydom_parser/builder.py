@@ -0,0 +1,329 @@
+"""Incremental build of a py-dom project
+
+Everything under the public folder is copied to the build folder as is, and every
+other .pyx file under the source folder is transpiled to a .py file at the same
+relative location (or compiled straight to a .pyc file, for bytecode builds). A manifest of content hashes in the build folder remembers
+what each output was built from, so only outputs whose source (or, for .pyx
+files, the grammar and transformer) changed are rebuilt. Transpiling happens on
+a process pool, and every output is written atomically.
+"""
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import pathlib
+import shutil
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from . import cache, instrument
+from .ast_transformer import transpile
+from .python_parser import build_parser
+
+__all__ = ["build", "BuildResult", "MANIFEST_NAME", "write_bundle", "BUNDLE_NAME", "write_pyc_bundle",
+           "PYC_BUNDLE_MANIFEST"]
+
+MANIFEST_NAME = ".pydom-manifest.json"
+
+# Fetched by py-dom.js in place of each of the Python files it holds
+BUNDLE_NAME = "bundle.zip"
+BUNDLE_SUFFIXES = (".py", ".pyc")
+
+# Describes the bytecode bundle, whose own name changes with its content
+PYC_BUNDLE_MANIFEST = "bundle.json"
+
+# Below this many files, starting worker processes costs more than it saves
+PARALLEL_THRESHOLD = 4
+
+
+class BuildResult:
+    def __init__(self):
+        self.built = []
+        self.skipped = []
+        self.removed = []
+        # Bundles written after building, see write_bundle and write_pyc_bundle
+        self.bundles = []
+        self.errors = {}
+        self.timings = {}
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def __repr__(self):
+        return (f"<BuildResult built={len(self.built)} skipped={len(self.skipped)} "
+                f"removed={len(self.removed)} errors={len(self.errors)} elapsed={self.elapsed:.3f}s>")
+
+
+def _hash_file(path, key=b""):
+    digest = hashlib.sha256(key)
+    with open(path, 'rb') as file:
+        digest.update(file.read())
+    return digest.hexdigest()
+
+
+def plan(src_dir, build_dir, public_dir=None, bytecode=False):
+    """Lists ``(source, output, kind)`` for every output of the build, where kind is either copy or transpile"""
+    src_dir = pathlib.Path(src_dir)
+    build_dir = pathlib.Path(build_dir)
+    public_dir = pathlib.Path(public_dir) if public_dir is not None else src_dir / "public"
+
+    jobs = []
+    if public_dir.is_dir():
+        for source in sorted(public_dir.rglob("*")):
+            if source.is_file() and "__pycache__" not in source.parts:
+                jobs.append((source, build_dir / source.relative_to(public_dir), "copy"))
+
+    for source in sorted(src_dir.rglob("*.pyx")):
+        if public_dir in source.parents or build_dir.resolve() in source.resolve().parents:
+            continue
+        suffix = ".pyc" if bytecode else ".py"
+        jobs.append((source, build_dir / source.relative_to(src_dir).with_suffix(suffix), "transpile"))
+    return jobs
+
+
+def load_manifest(build_dir):
+    try:
+        with open(pathlib.Path(build_dir) / MANIFEST_NAME) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def transpile_to(source, output, format=True):
+    """Transpiles ``source`` into ``output`` atomically, returns the time it took"""
+    start = time.perf_counter()
+    with open(source, 'r') as inputfile, instrument.profiled(source):
+        result = transpile(inputfile.read(), format=format, filename=os.fspath(source))
+    cache.atomic_write(output, result.encode())
+    return time.perf_counter() - start
+
+
+def compile_to(source, output):
+    """Compiles ``source`` straight to a .pyc file at ``output``, without going through Python source"""
+    start = time.perf_counter()
+    with open(source, 'rb') as inputfile:
+        data = inputfile.read()
+    with instrument.profiled(source):
+        code = cache.compile_source(data, os.fspath(source))
+    cache.atomic_write(output, cache.pyc_bytes(code, cache.source_hash(data)))
+    return time.perf_counter() - start
+
+
+def _observed(convert, profile_dir, source, output):
+    """Runs ``convert`` in a worker process, returning the stages it went through along with its time"""
+    instrument.profile_dir = profile_dir
+    stages = []
+    with instrument.observing(stages.append):
+        elapsed = convert(source, output)
+    return elapsed, stages
+
+
+def copy_to(source, output):
+    start = time.perf_counter()
+    with open(source, 'rb') as inputfile:
+        cache.atomic_write(output, inputfile.read())
+    shutil.copymode(source, output)
+    return time.perf_counter() - start
+
+
+def _remove(paths, result):
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        result.removed.append(path)
+
+
+def build(src_dir="src", build_dir="build", public_dir=None, jobs=None, force=False, format=True, bytecode=False,
+          bundle=False, pyc_bundle=False):
+    """Brings ``build_dir`` up to date with ``src_dir``
+
+    ``jobs`` is the number of worker processes transpiling in parallel (the number
+    of CPUs by default, 1 to transpile in this process), and ``force`` rebuilds
+    everything regardless of the manifest.
+
+    ``format=False`` skips formatting the transpiled source with autopep8, and
+    ``bytecode`` writes .pyc files instead of source. Bytecode only loads on the
+    Python version it was compiled with, which must match the one of Pyodide.
+
+    ``bundle`` and ``pyc_bundle`` rewrite the bundles of ``write_bundle`` and
+    ``write_pyc_bundle`` once built, without them a bundle left by an earlier build
+    is removed, as py-dom.js would load it instead of the files built now.
+    """
+    start = time.perf_counter()
+    build_dir = pathlib.Path(build_dir)
+    result = BuildResult()
+    manifest = {} if force else load_manifest(build_dir)
+    new_manifest = {}
+
+    # Outputs of a different mode need rebuilding too
+    mode = "bytecode" if bytecode else "source" if format else "unformatted"
+    grammar_key = cache.grammar_key() + mode.encode()
+    if bytecode:
+        convert = compile_to
+    else:
+        convert = partial(transpile_to, format=format)
+
+    outputs = set()
+    pending = []
+    for source, output, kind in plan(src_dir, build_dir, public_dir, bytecode):
+        key = os.fspath(output.relative_to(build_dir))
+        digest = _hash_file(source, grammar_key if kind == "transpile" else b"")
+        entry = {"source": os.fspath(source), "hash": digest}
+        outputs.add(key)
+        if manifest.get(key) == entry and output.exists():
+            new_manifest[key] = entry
+            result.skipped.append(output)
+        else:
+            pending.append((source, output, kind, key, entry))
+
+    copies = [job for job in pending if job[2] == "copy"]
+    transpiles = [job for job in pending if job[2] == "transpile"]
+
+    for source, output, _, key, entry in copies:
+        try:
+            result.timings[output] = copy_to(source, output)
+        except OSError as e:
+            result.errors[output] = e
+        else:
+            new_manifest[key] = entry
+            result.built.append(output)
+
+    if transpiles:
+        # Workers load the serialized parser tables instead of each compiling the grammar
+        build_parser()
+        workers = jobs if jobs is not None else os.cpu_count() or 1
+        if workers > 1 and len(transpiles) >= PARALLEL_THRESHOLD:
+            # Observers and profiling live in this process, workers send their stages back
+            observed = instrument.active() or instrument.profile_dir is not None
+            task = partial(_observed, convert, instrument.profile_dir) if observed else convert
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [(job, pool.submit(task, job[0], job[1])) for job in transpiles]
+                outcomes = []
+                for job, future in futures:
+                    error = future.exception()
+                    elapsed = None
+                    if error is None:
+                        elapsed = future.result()
+                        if observed:
+                            elapsed, stages = elapsed
+                            for stage in stages:
+                                instrument.report(stage)
+                    outcomes.append((job, error, elapsed))
+        else:
+            outcomes = []
+            for job in transpiles:
+                try:
+                    outcomes.append((job, None, convert(job[0], job[1])))
+                except Exception as e:
+                    outcomes.append((job, e, None))
+
+        for (source, output, _, key, entry), error, elapsed in outcomes:
+            if error is not None:
+                result.errors[output] = error
+            else:
+                new_manifest[key] = entry
+                result.timings[output] = elapsed
+                result.built.append(output)
+
+    # Outputs of sources which no longer exist, failed outputs are left out of the
+    # manifest so that they're retried next time
+    for key in manifest.keys() - outputs:
+        output = build_dir / key
+        try:
+            output.unlink()
+        except FileNotFoundError:
+            pass
+        result.removed.append(output)
+
+    cache.atomic_write(build_dir / MANIFEST_NAME, json.dumps(new_manifest, indent=1, sort_keys=True).encode())
+
+    if bundle:
+        result.bundles.append(write_bundle(build_dir))
+    elif BUNDLE_NAME not in outputs:
+        _remove([build_dir / BUNDLE_NAME], result)
+    if pyc_bundle:
+        result.bundles.append(write_pyc_bundle(build_dir))
+    else:
+        stale = [build_dir / PYC_BUNDLE_MANIFEST, *build_dir.glob("bundle-*-*.zip")]
+        _remove([path for path in stale if path.name not in outputs], result)
+
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _zip_entry(name):
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def write_bundle(build_dir="build", name=BUNDLE_NAME):
+    """Zips the Python files of ``build_dir`` into ``name``, for py-dom.js to fetch in one go
+
+    Entries are sorted and carry no timestamps, so the bundle only changes when
+    the files do, and stays cached by the browser otherwise.
+    """
+    build_dir = pathlib.Path(build_dir)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as bundle:
+        for path in sorted(build_dir.rglob("*")):
+            if path.suffix not in BUNDLE_SUFFIXES or "__pycache__" in path.parts or not path.is_file():
+                continue
+            bundle.writestr(_zip_entry(path.relative_to(build_dir).as_posix()), path.read_bytes())
+    output = build_dir / name
+    cache.atomic_write(output, buffer.getvalue())
+    return output
+
+
+def write_pyc_bundle(build_dir="build"):
+    """Compiles the Python files of ``build_dir`` into a zip of .pyc files, importable through zipimport
+
+    Bytecode only runs on the Python version it was compiled by, so this has to
+    run on the version of the targeted Pyodide. The bundle is named after that
+    version and a hash of its content, so browsers can cache it for good, and
+    ``bundle.json`` (fetched fresh every time) points at the current one:
+
+        {"python": cache tag, "magic": hex of the .pyc magic number,
+         "bundle": file name, "modules": {path in the bundle: sha256 of the .pyc}}
+    """
+    build_dir = pathlib.Path(build_dir)
+    modules = {}
+    for path in sorted(build_dir.rglob("*")):
+        if "__pycache__" in path.parts or not path.is_file() or path.suffix not in BUNDLE_SUFFIXES:
+            continue
+        name = path.relative_to(build_dir).with_suffix(".pyc").as_posix()
+        data = path.read_bytes()
+        if path.suffix == ".py":
+            code = compile(data, path.relative_to(build_dir).as_posix(), "exec", dont_inherit=True)
+            data = cache.pyc_bytes(code, importlib.util.source_hash(data), check_source=False)
+        modules[name] = data
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as bundle:
+        for name, data in modules.items():
+            bundle.writestr(_zip_entry(name), data)
+    data = buffer.getvalue()
+
+    tag = sys.implementation.cache_tag
+    output = build_dir / f"bundle-{tag}-{hashlib.sha256(data).hexdigest()[:12]}.zip"
+    for stale in build_dir.glob(f"bundle-{tag}-*.zip"):
+        if stale != output:
+            stale.unlink()
+    cache.atomic_write(output, data)
+
+    manifest = {
+        "python": tag,
+        "magic": importlib.util.MAGIC_NUMBER.hex(),
+        "bundle": output.name,
+        "modules": {name: hashlib.sha256(pyc).hexdigest() for name, pyc in modules.items()},
+    }
+    cache.atomic_write(build_dir / PYC_BUNDLE_MANIFEST, json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return output
@@ -0,0 +1,172 @@
+"""On-disk bytecode cache for .pyx modules
+
+Cache files use the hash-based .pyc layout of PEP 552:
+
+1. The Python version magic number, `importlib.util.MAGIC_NUMBER`
+2. A little-endian 32 bit flags field, 0b11 meaning "hash-based, checked"
+3. An 8 byte hash of the source, here also covering the grammar and transformer
+   that produced the code, so changing either of them invalidates every entry
+4. The marshalled code object
+
+Entries are written to a temporary file and then renamed over the old one, so a
+crashed or concurrent writer never leaves a truncated entry behind.
+"""
+import hashlib
+import importlib.util
+import marshal
+import os
+import struct
+import sys
+import tempfile
+
+import lark
+
+from . import ast_transformer, instrument
+from .ast_transformer import TRANSFORMER_VERSION, parse
+
+__all__ = ["cache_dir", "set_cache_dir", "cache_path", "source_hash", "read", "write", "load_code", "atomic_write",
+           "pyc_bytes", "compile_source"]
+
+GRAMMAR_PATH = os.path.join(os.path.dirname(__file__), "pyx.lark")
+
+FLAG_HASH_BASED = 0b01
+FLAG_CHECK_SOURCE = 0b10
+
+# Where cache entries go, by default a __pycache__ folder next to each source file
+cache_dir = os.environ.get("PYDOM_CACHE_DIR") or None
+
+_grammar_key = None
+
+
+def set_cache_dir(path):
+    """Puts every cache entry in ``path``, or next to their source again if None"""
+    global cache_dir
+    cache_dir = os.fspath(path) if path is not None else None
+
+
+def grammar_key():
+    """Digest of everything besides the source that decides what a .pyx compiles to"""
+    global _grammar_key
+    if _grammar_key is None:
+        digest = hashlib.sha256()
+        with open(GRAMMAR_PATH, 'rb') as grammar:
+            digest.update(grammar.read())
+        digest.update(f"{TRANSFORMER_VERSION}:{lark.__version__}".encode())
+        _grammar_key = digest.digest()
+    # Read every time, as it can be switched off at any point
+    return _grammar_key + (b"static" if ast_transformer.COMPILE_STATIC else b"")
+
+
+def source_hash(source: bytes) -> bytes:
+    return importlib.util.source_hash(grammar_key() + source)
+
+
+def cache_path(source_path):
+    source_path = os.path.abspath(source_path)
+    directory, filename = os.path.split(source_path)
+    stem = filename.rsplit(".", 1)[0]
+    if cache_dir is None:
+        return os.path.join(directory, "__pycache__", f"{stem}.{sys.implementation.cache_tag}.pyx.pyc")
+
+    # A shared directory needs to tell apart modules with the same name
+    location = hashlib.sha1(directory.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{stem}-{location}.{sys.implementation.cache_tag}.pyx.pyc")
+
+
+def read(path, expected_hash: bytes):
+    """Returns the cached code at ``path`` if it was compiled from a source with ``expected_hash``"""
+    try:
+        with open(path, 'rb') as pyc:
+            data = pyc.read()
+    except OSError:
+        return None
+
+    if len(data) < 16 or data[:4] != importlib.util.MAGIC_NUMBER:
+        return None
+    flags, = struct.unpack('<I', data[4:8])
+    if not flags & FLAG_HASH_BASED or data[8:16] != expected_hash:
+        return None
+    try:
+        return marshal.loads(data[16:])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def write(path, code, hash_: bytes) -> bool:
+    """Atomically writes ``code`` to ``path``, returns False if the cache isn't writable"""
+    if sys.dont_write_bytecode:
+        return False
+    try:
+        atomic_write(path, pyc_bytes(code, hash_))
+    except OSError:
+        return False
+    return True
+
+
+def pyc_bytes(code, hash_: bytes, check_source=True) -> bytes:
+    """The .pyc layout described above, ``check_source=False`` for bytecode shipped without its source"""
+    return b"".join((
+        importlib.util.MAGIC_NUMBER,
+        struct.pack('<I', FLAG_HASH_BASED | (FLAG_CHECK_SOURCE if check_source else 0)),
+        hash_,
+        marshal.dumps(code),
+    ))
+
+
+def _umask() -> int:
+    # Only readable by setting it, done once at import before any worker threads
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+_UMASK = _umask()
+
+
+def atomic_write(path, data: bytes) -> None:
+    """Writes ``data`` to a temporary file next to ``path`` and renames it over ``path``
+
+    The file keeps the mode of the one it replaces, or gets the mode ``open`` would
+    have given it, rather than the owner only mode of temporary files.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = 0o666 & ~_UMASK
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            temp.write(data)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def compile_source(source: bytes, filename):
+    tree = parse(source.decode("utf-8") + "\n", filename)
+    with instrument.stage("compile", filename):
+        return compile(tree, filename, "exec")
+
+
+def load_code(source_path):
+    """Returns ``(code, hit)`` for a .pyx file, only parsing it if the cache is out of date"""
+    with instrument.stage("cache", source_path) as info:
+        with open(source_path, 'rb') as source_file:
+            source = source_file.read()
+
+        hash_ = source_hash(source)
+        path = cache_path(source_path)
+        code = read(path, hash_)
+        if info is not None:
+            info["hit"] = code is not None
+        if code is not None:
+            return code, True
+
+        with instrument.profiled(source_path):
+            code = compile_source(source, os.fspath(source_path))
+        write(path, code, hash_)
+        return code, False
@@ -0,0 +1,122 @@
+"""Hooks reporting where transpiling a .pyx file spends its time
+
+Observers added with ``add_observer`` are called with a ``Stage`` for each step a
+file goes through:
+
+* ``parse``: lark, with the number of ``tokens`` kept in the parse tree
+* ``transform``: ToAst, with the number of ``nodes`` in the resulting tree
+* ``static``: compiling static markup ahead of time, see ``StaticMarkup``
+* ``fix_locations``: ``ast.fix_missing_locations``
+* ``unparse`` and ``format``: back to Python source, and autopep8
+* ``compile``: to a code object
+* ``cache``: loading a module for the import hook, with whether the bytecode cache was a ``hit``
+
+Nothing is measured while there are no observers.
+
+    with instrument.observing(print):
+        pydom_parser.transpile(source)
+
+Setting ``profile_dir`` (or ``$PYDOM_PROFILE_DIR``) also saves a cProfile capture
+of every file compiled or transpiled, as ``<profile_dir>/<file>.prof``.
+"""
+import cProfile
+import os
+import time
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+
+__all__ = ["Stage", "StageTotals", "add_observer", "remove_observer", "observing", "active", "stage", "report",
+           "profiled", "profile_dir"]
+
+# Where profiles of each file go, None to not profile
+profile_dir = os.environ.get("PYDOM_PROFILE_DIR") or None
+
+_observers = []
+
+
+class Stage(NamedTuple):
+    stage: str
+    filename: Optional[str]
+    seconds: float
+    info: dict
+
+
+class StageTotals:
+    """An observer adding up the time and count of each stage"""
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        self.files = set()
+
+    def __call__(self, stage: Stage) -> None:
+        self.seconds[stage.stage] = self.seconds.get(stage.stage, 0.0) + stage.seconds
+        self.counts[stage.stage] = self.counts.get(stage.stage, 0) + 1
+        if stage.filename is not None:
+            self.files.add(stage.filename)
+
+    def summary(self) -> str:
+        return "\n".join(
+            f"  {name:<14} {seconds * 1000:10.1f} ms  {self.counts[name]:5}x"
+            for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])
+        )
+
+
+def add_observer(observer) -> None:
+    """Calls ``observer(stage)`` for every stage from now on"""
+    _observers.append(observer)
+
+
+def remove_observer(observer) -> None:
+    _observers.remove(observer)
+
+
+@contextmanager
+def observing(observer):
+    add_observer(observer)
+    try:
+        yield observer
+    finally:
+        remove_observer(observer)
+
+
+def active() -> bool:
+    return bool(_observers)
+
+
+def report(stage: Stage) -> None:
+    for observer in tuple(_observers):
+        observer(stage)
+
+
+@contextmanager
+def stage(name, filename=None):
+    """Times the body and reports it as stage ``name``
+
+    Yields a dict for details about the stage, or None when nobody is observing, in
+    which case those details shouldn't be worked out at all.
+    """
+    if not _observers:
+        yield None
+        return
+    info = {}
+    start = time.perf_counter()
+    yield info
+    report(Stage(name, None if filename is None else os.fspath(filename), time.perf_counter() - start, info))
+
+
+@contextmanager
+def profiled(filename):
+    """Saves a cProfile capture of the body to ``profile_dir``, if set"""
+    if profile_dir is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        name = os.path.relpath(os.path.abspath(filename)).replace(os.sep, ".").lstrip(".")
+        os.makedirs(profile_dir, exist_ok=True)
+        profile.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
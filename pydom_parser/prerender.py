@@ -0,0 +1,57 @@
+"""Renders the app of a build ahead of time, into the #root of its page
+
+The browser then shows the app right away, and once Pyodide has loaded,
+``Element.render_root`` attaches to that markup instead of replacing it.
+Components run under plain CPython here, without a document (see backend.py).
+"""
+import importlib
+import json
+import os
+import pathlib
+import re
+import sys
+
+from . import cache
+from .builder import MANIFEST_NAME, load_manifest
+
+__all__ = ["prerender", "render_app"]
+
+_ROOT = re.compile(r'(<div id="root"[^>]*)>\s*</div>')
+
+
+def render_app(build_dir, module="app", component="App"):
+    """Imports ``module`` from ``build_dir`` and renders a new ``component`` to html"""
+    build_dir = os.path.abspath(build_dir)
+    saved_path, saved_modules = list(sys.path), set(sys.modules)
+    sys.path.insert(0, build_dir)
+    try:
+        backend = importlib.import_module("backend")
+        backend.set_backend(backend.ServerBackend())
+        pydom = importlib.import_module("pydom")
+        app = getattr(importlib.import_module(module), component)
+        return pydom.render_to_string(app())
+    finally:
+        # The modules of the build aren't meant to stay around in this process
+        sys.path[:] = saved_path
+        for name in set(sys.modules) - saved_modules:
+            del sys.modules[name]
+
+
+def prerender(src_dir="src", build_dir="build", public_dir=None, page="index.html", module="app", component="App"):
+    """Writes the build's ``page`` with the app rendered into its empty ``<div id="root">``"""
+    build_dir = pathlib.Path(build_dir)
+    public_dir = pathlib.Path(public_dir) if public_dir is not None else pathlib.Path(src_dir) / "public"
+    with open(public_dir / page) as template:
+        markup = template.read()
+
+    html = render_app(build_dir, module, component)
+    markup, found = _ROOT.subn(lambda match: f'{match.group(1)} data-ssr>{html}</div>', markup, count=1)
+    if not found:
+        raise ValueError(f'{public_dir / page} has no empty <div id="root"></div> to render into')
+    cache.atomic_write(build_dir / page, markup.encode())
+
+    # The page no longer is a copy of its source, the next build copies it again
+    manifest = load_manifest(build_dir)
+    if manifest.pop(page, None) is not None:
+        cache.atomic_write(build_dir / MANIFEST_NAME, json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return build_dir / page
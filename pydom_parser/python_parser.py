@@ -18,10 +18,36 @@ from lark.indenter import PythonIndenter
 
 kwargs = dict(postlex=PythonIndenter(), start='file_input')
 
-# Official Python grammar by Lark
-python_parser3 = Lark.open('pyx.lark', rel_to=__file__, parser='lalr', **kwargs)
+GRAMMAR_PATH = os.path.join(os.path.dirname(__file__), 'pyx.lark')
 
-chosen_parser = python_parser3
+# The analysed grammar and LALR tables are serialized here the first time the parser is built
+# (see build_parser), later processes load them instead of compiling the grammar again.
+# Lark keys the file on the grammar, the options and the lark and Python versions, so editing
+# pyx.lark rebuilds it automatically.
+PARSER_CACHE_PATH = os.environ.get('PYDOM_PARSER_CACHE') or GRAMMAR_PATH + '.cache'
+
+_parser = None
+
+
+def build_parser(cache_path=PARSER_CACHE_PATH):
+    """Builds the parser, loading its tables from ``cache_path`` if they are up to date, else writing them there"""
+    # Official Python grammar by Lark
+    return Lark.open(GRAMMAR_PATH, parser='lalr', cache=cache_path or False, **kwargs)
+
+
+def get_parser():
+    """The shared parser, built on first use rather than on import"""
+    global _parser
+    if _parser is None:
+        _parser = build_parser()
+    return _parser
+
+
+def __getattr__(name):
+    # Kept for compatibility, these used to be built on import
+    if name in ('python_parser3', 'chosen_parser'):
+        return get_parser()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def _read(fn, *args):
@@ -50,8 +76,9 @@ def test_python_lib():
         r = _read(os.path.join(path, f))
         kb = len(r) / 1024
         print('%s -\t%.1f kb' % (f, kb))
-        chosen_parser.parse(r + '\n')
+        get_parser().parse(r + '\n')
         total_kb += kb
 
     end = time.time()
-    print("test_python_lib (%d files, %.1f kb), time: %.2f secs" % (len(files), total_kb, end - start))
\ No newline at end of file
+    print("test_python_lib (%d files, %.1f kb), time: %.2f secs" % (len(files), total_kb, end - start))
+
@@ -0,0 +1,292 @@
+"""Keeps a build folder up to date while sources are being edited
+
+The transpiler stays loaded between rebuilds, so a change only costs the time to
+transpile the files that changed. Changes are picked up through inotify on Linux,
+and by polling modification times everywhere else.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import pathlib
+import re
+import select
+import struct
+import sys
+import time
+
+from . import instrument
+from .builder import build
+from .python_parser import get_parser
+
+__all__ = ["watch", "DependencyGraph", "InotifyWatcher", "PollingWatcher", "make_watcher"]
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT = struct.Struct("iIII")
+
+_IMPORT = re.compile(
+    r"^[ \t]*(?:import[ \t]+(?P<names>[\w., \t]+)|from[ \t]+(?P<module>[.\w]+)[ \t]+import[ \t]+(?P<from_names>.+))$",
+    re.MULTILINE,
+)
+
+
+class InotifyWatcher:
+    """Reports changed files under a folder, recursively, through Linux' inotify"""
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        libc_name = ctypes.util.find_library("c")
+        if sys.platform != "linux" or libc_name is None:
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        for directory, _, _ in os.walk(self.root):
+            self._add_watch(pathlib.Path(directory))
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self._watches[wd] = directory
+
+    def _read(self):
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Watch new folders too, and whatever was already put in them
+                    for sub, _, files in os.walk(path):
+                        self._add_watch(pathlib.Path(sub))
+                        changed.update(pathlib.Path(sub) / file for file in files)
+                continue
+            changed.add(path)
+        return changed
+
+    def wait(self, timeout=None, settle=0.05):
+        """Blocks until something changes, then returns the changed paths
+
+        Events keep being collected until none arrived for ``settle`` seconds, as
+        editors tend to save through several writes and renames.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = self._read()
+        while select.select([self._fd], [], [], settle)[0]:
+            changed |= self._read()
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Reports changed files under a folder by comparing modification times"""
+
+    def __init__(self, root, interval=0.25):
+        self.root = pathlib.Path(root)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for directory, _, files in os.walk(self.root):
+            for file in files:
+                path = pathlib.Path(directory) / file
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout=None, settle=0.05):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval)
+            snapshot = self._scan()
+            changed = {
+                path for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(root, poll=False):
+    if not poll:
+        try:
+            return InotifyWatcher(root)
+        except OSError:
+            pass
+    return PollingWatcher(root)
+
+
+class DependencyGraph:
+    """Which .pyx modules of a project import which others
+
+    Imports are read straight from the sources with a line scan, which is all the
+    graph needs and doesn't depend on the file transpiling successfully.
+    """
+
+    def __init__(self, src_dir, public_dir=None):
+        self.src_dir = pathlib.Path(src_dir)
+        self.public_dir = pathlib.Path(public_dir) if public_dir is not None else self.src_dir / "public"
+        self.imports = {}
+
+    def module_name(self, source):
+        parts = list(pathlib.Path(source).relative_to(self.src_dir).with_suffix("").parts)
+        if parts[-1] == "__init__":
+            parts.pop()
+        return ".".join(parts)
+
+    def update(self, source):
+        """Re-reads the imports of ``source``"""
+        name = self.module_name(source)
+        try:
+            text = pathlib.Path(source).read_text()
+        except OSError:
+            self.imports.pop(name, None)
+            return
+
+        package = name if pathlib.Path(source).stem == "__init__" else name.rpartition(".")[0]
+        imported = set()
+        for match in _IMPORT.finditer(text):
+            if match.group("names") is not None:
+                imported.update(alias.split()[0] for alias in match.group("names").split(",") if alias.strip())
+                continue
+            base = match.group("module")
+            level = len(base) - len(base.lstrip("."))
+            base = base.lstrip(".")
+            if level:
+                parent = package.split(".") if package else []
+                parent = parent[:len(parent) - level + 1]
+                base = ".".join(filter(None, parent + [base]))
+            imported.add(base)
+            for alias in match.group("from_names").strip("()\\ ").split(","):
+                if alias.strip():
+                    imported.add(f"{base}.{alias.split()[0]}" if base else alias.split()[0])
+        self.imports[name] = imported
+
+    def remove(self, source):
+        self.imports.pop(self.module_name(source), None)
+
+    def scan(self):
+        for source in self.src_dir.rglob("*.pyx"):
+            if self.public_dir not in source.parents:
+                self.update(source)
+
+    def dependents(self, names):
+        """Every module importing one of ``names``, directly or not"""
+        found = set()
+        pending = list(names)
+        while pending:
+            target = pending.pop()
+            for name, imported in self.imports.items():
+                if target in imported and name not in found:
+                    found.add(name)
+                    pending.append(name)
+        return found - set(names)
+
+
+def _timed_build(timings, *args, **kwargs):
+    """``build``, and the stage totals it took if ``timings``, else None"""
+    if not timings:
+        return build(*args, **kwargs), None
+    with instrument.observing(instrument.StageTotals()) as totals:
+        return build(*args, **kwargs), totals
+
+
+def _print_timings(totals, out):
+    if totals is not None and totals.counts:
+        out(f"  stages over {len(totals.files)} files:")
+        out(totals.summary())
+
+
+def watch(src_dir="src", build_dir="build", public_dir=None, poll=False, jobs=None, format=True, bytecode=False,
+          bundle=False, pyc_bundle=False, timings=False, out=print):
+    """Builds, then rebuilds whatever changes under ``src_dir`` until interrupted
+
+    With ``timings``, the time spent in each stage of transpiling is printed after
+    every build.
+    """
+    src_dir = pathlib.Path(src_dir)
+    get_parser()  # Loaded once, and kept for every rebuild
+
+    result, totals = _timed_build(timings, src_dir, build_dir, public_dir, jobs=jobs, format=format,
+                                  bytecode=bytecode, bundle=bundle, pyc_bundle=pyc_bundle)
+    out(f"Built {len(result.built)} files ({len(result.skipped)} up to date) in {result.elapsed:.2f}s")
+    for output, error in result.errors.items():
+        out(f"  failed {output}: {error}")
+    _print_timings(totals, out)
+
+    graph = DependencyGraph(src_dir, public_dir)
+    graph.scan()
+    watcher = make_watcher(src_dir, poll)
+    out(f"Watching {src_dir} ({type(watcher).__name__}), Ctrl+C to stop")
+    try:
+        while True:
+            changed = watcher.wait()
+            if not changed:
+                continue
+            # Incremental rebuilds are small, skip the process pool
+            result, totals = _timed_build(timings, src_dir, build_dir, public_dir, jobs=1, format=format,
+                                          bytecode=bytecode, bundle=bundle, pyc_bundle=pyc_bundle)
+
+            sources = [path for path in changed if path.suffix == ".pyx" and graph.public_dir not in path.parents]
+            for source in sources:
+                if source.exists():
+                    graph.update(source)
+                else:
+                    graph.remove(source)
+            affected = graph.dependents({graph.module_name(source) for source in sources})
+
+            for output in result.built:
+                out(f"  built {output} in {result.timings[output] * 1000:.1f} ms")
+            for output in result.bundles:
+                out(f"  bundled {output}")
+            for output in result.removed:
+                out(f"  removed {output}")
+            for output, error in result.errors.items():
+                out(f"  failed {output}: {error}")
+            if affected:
+                out(f"  importers to reload: {', '.join(sorted(affected))}")
+            out(f"Rebuilt in {result.elapsed * 1000:.0f} ms")
+            _print_timings(totals, out)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
@@ -0,0 +1,115 @@
+"""The environment py-dom renders into.
+
+In the browser, this is the document and event loop Pyodide exposes through the
+``js`` module. Without ``js``, for instance when rendering pages ahead of time
+on a server, there is no document: components can only be rendered to html,
+which the browser then hydrates.
+
+Another environment can be plugged in with ``set_backend``.
+"""
+
+import asyncio
+
+try:
+    import js
+except ImportError:  # Headless, e.g. under plain CPython
+    js = None
+
+
+class Backend:
+    """A backend without a document, which can only render to html"""
+
+    document = None
+
+    def request_animation_frame(self, callback) -> bool:
+        """Calls ``callback(timestamp)`` before the next repaint, returns False if it can't"""
+        return False
+
+    def request_idle_callback(self, callback) -> bool:
+        """Calls ``callback(deadline)`` once the browser is idle, returns False if it can't"""
+        return False
+
+    def listen(self, event_type: str) -> None:
+        """Makes sure events of ``event_type`` reach ``pydom.dispatch``"""
+
+    def create_task(self, coroutine):
+        """Runs ``coroutine`` on the event loop, returns None if there is none running"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        return loop.create_task(coroutine)
+
+    async def fetch(self, url: str, **options):
+        """The body of ``url``, decoded from JSON if it is"""
+        raise RuntimeError(f"{type(self).__name__} can't fetch {url}")
+
+
+ServerBackend = Backend
+
+
+class BrowserBackend(Backend):
+    def __init__(self, js_module):
+        self.js = js_module
+        self.document = js_module.document
+
+    def request_animation_frame(self, callback) -> bool:
+        request_animation_frame = getattr(self.js, "requestAnimationFrame", None)
+        if request_animation_frame is None:
+            return False
+        request_animation_frame(_once(callback))
+        return True
+
+    def request_idle_callback(self, callback) -> bool:
+        request_idle_callback = getattr(self.js, "requestIdleCallback", None)
+        if request_idle_callback is not None:
+            request_idle_callback(_once(callback))
+            return True
+        # Safari has no requestIdleCallback, a timeout still lets events through first
+        set_timeout = getattr(self.js, "setTimeout", None)
+        if set_timeout is None:
+            return False
+        set_timeout(_once(lambda: callback(None)), 0)
+        return True
+
+    def listen(self, event_type: str) -> None:
+        # py-dom.js adds one listener per event type on #root
+        delegate = getattr(self.js, "pyDomDelegate", None)
+        if delegate is not None:
+            delegate(event_type)
+
+    def create_task(self, coroutine):
+        # Pyodide's loop runs on the browser's, whether Python is running or not
+        return asyncio.ensure_future(coroutine)
+
+    async def fetch(self, url: str, **options):
+        from pyodide.http import pyfetch
+        response = await pyfetch(url, **options)
+        if not response.ok:
+            raise OSError(f"fetching {url} failed with status {response.status}")
+        if "json" in response.headers.get("content-type", ""):
+            return await response.json()
+        return await response.string()
+
+
+def _once(callback):
+    try:
+        from pyodide.ffi import create_once_callable
+    except ImportError:
+        return callback
+    return create_once_callable(callback)
+
+
+current = BrowserBackend(js) if getattr(js, "document", None) is not None else ServerBackend()
+
+
+def set_backend(backend: Backend) -> None:
+    global current
+    current = backend
+
+
+def document():
+    """The document of the current backend, raises if it doesn't have one"""
+    if current.document is None:
+        raise RuntimeError(f"{type(current).__name__} has no document, render to html instead")
+    return current.document
@@ -0,0 +1,150 @@
+"""Opt-in profiling of Element renders, to find components re-rendering more than they should
+
+    import profiler
+    profiler.enable()
+    ...  # use the app
+    profiler.print_summary()
+
+For each Element class, this counts renders and the renders skipped because the
+last one was still up to date, times them (in total, and by themselves without
+the Elements nested in them), adds up the html they emit (the whole page for the
+Element mounted or passed to ``render_to_string``, as updates are patched rather
+than serialized), times patching the document, and counts which attributes set
+on them scheduled a re-render.
+Nothing is recorded until ``enable`` is called.
+"""
+import json
+import time
+from collections import Counter
+
+enabled = False
+
+_stats = {}
+# Renders in progress, innermost last: [element, start, time spent in nested renders]
+_stack = []
+
+
+class ComponentStats:
+    def __init__(self):
+        self.renders = 0
+        self.reused = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self.html_bytes = 0
+        self.patches = 0
+        self.patch_time = 0.0
+        self.triggers = Counter()
+
+    def as_dict(self) -> dict:
+        return {
+            "renders": self.renders,
+            "reused": self.reused,
+            "total_time": self.total_time,
+            "self_time": self.self_time,
+            "html_bytes": self.html_bytes,
+            "patches": self.patches,
+            "patch_time": self.patch_time,
+            "triggers": dict(self.triggers.most_common()),
+        }
+
+
+def enable() -> None:
+    global enabled
+    enabled = True
+
+
+def disable() -> None:
+    global enabled
+    enabled = False
+
+
+def reset() -> None:
+    _stats.clear()
+    _stack.clear()
+
+
+def _get(element) -> ComponentStats:
+    name = type(element).__qualname__
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = ComponentStats()
+    return stats
+
+
+#
+#   Called by pydom.Element while enabled
+#
+
+
+def trigger(element, attribute: str) -> None:
+    _get(element).triggers[attribute] += 1
+
+
+def reused(element) -> None:
+    _get(element).reused += 1
+
+
+def render_started(element) -> None:
+    _stack.append([element, time.perf_counter(), 0.0])
+
+
+def render_finished(element) -> None:
+    if not _stack or _stack[-1][0] is not element:
+        return
+    _, start, nested = _stack.pop()
+    elapsed = time.perf_counter() - start
+    stats = _get(element)
+    stats.renders += 1
+    stats.total_time += elapsed
+    stats.self_time += elapsed - nested
+    if _stack:
+        _stack[-1][2] += elapsed
+
+
+def emitted(element, html: str) -> None:
+    _get(element).html_bytes += len(html.encode())
+
+
+def patched(element, seconds: float) -> None:
+    stats = _get(element)
+    stats.patches += 1
+    stats.patch_time += seconds
+
+
+#
+#   Reading the results
+#
+
+
+def stats() -> dict:
+    """What was recorded so far, by Element class name, in plain types to dump as JSON"""
+    return {name: stats.as_dict() for name, stats in _stats.items()}
+
+
+def dump(path=None) -> str:
+    """``stats()`` as JSON, also written to ``path`` if given"""
+    data = json.dumps(stats(), indent=2)
+    if path is not None:
+        with open(path, "w") as file:
+            file.write(data)
+    return data
+
+
+def summary(sort: str = "self_time", limit: int = 20) -> str:
+    """A table of the components with the highest ``sort``, a key of ``ComponentStats.as_dict``"""
+    rows = sorted(stats().items(), key=lambda item: -item[1][sort])[:limit]
+    lines = [f"{'component':<24} {'renders':>8} {'reused':>8} {'total ms':>10} {'self ms':>10} "
+             f"{'html kB':>9} {'patch ms':>10}  triggers"]
+    for name, row in rows:
+        triggers = ", ".join(f"{attribute} x{count}" for attribute, count in list(row["triggers"].items())[:3])
+        lines.append(
+            f"{name:<24} {row['renders']:>8} {row['reused']:>8} {row['total_time'] * 1000:>10.2f} "
+            f"{row['self_time'] * 1000:>10.2f} {row['html_bytes'] / 1000:>9.1f} {row['patch_time'] * 1000:>10.2f}"
+            f"  {triggers}"
+        )
+    return "\n".join(lines)
+
+
+def print_summary(sort: str = "self_time", limit: int = 20) -> None:
+    """Prints ``summary``, which ends up in the browser console under Pyodide"""
+    print(summary(sort, limit))
@@ -1,87 +1,123 @@
-window.pyodide = await loadPyodide()
-await pyodide.loadPackage("micropip")
-const micropip = pyodide.pyimport("micropip")
-
-const dependencies = [
-    "astpretty",
-    "cssutils",
-    "lark",
-    "autopep8",
-    "astunparse"
+// Python files the runtime needs, next to this script
+const runtime_files = [
+    "backend.py",
+    "tinyhtml.py",
+    "vdom.py",
+    "scheduler.py",
+    "profiler.py",
+    "resources.py",
+    "pydom.py",
 ]
 
-for (const dependency of dependencies) {
-    await micropip.install(dependency)
-}
-
+// Either a transpiled app, or one to transpile in the browser
+const app_files = [
+    "app.py",
+    "app.pyx",
+]
 
-const local_deps = [
-    "tinyhtml.py",
-    "pydom.py",
+// Only needed to transpile app.pyx in the browser
+const parser_packages = [
+    "lark",
 ]
 
-const pyx_deps = [
+const parser_files = [
     "pydom_parser/__init__.py",
     "pydom_parser/ast_transformer.py",
+    "pydom_parser/cache.py",
     "pydom_parser/import_handler.py",
+    "pydom_parser/instrument.py",
     "pydom_parser/python_parser.py",
-    "pydom_parser/unparse.py",
     "pydom_parser/pyx.lark",
+    "pydom_parser/pyx.lark.cache",
 ]
 
-await pyodide.runPythonAsync(`
-    import os; os.mkdir("pydom_parser")
-`)
-
-async function load_file(file) {
-    return await pyodide.runPythonAsync(`
-        from pyodide.http import pyfetch
-        response = await pyfetch("${file}")
-        if (not response.ok):
-            result = None
-        else:
-            with open("${file}", "w") as f:
-                bytes = await response.bytes()
-                text = bytes.decode() + "\\n"
-                f.write(text)
-                
-            result = text
-             
-        result
-`)
+// Made by `build.py --bundle`, holds all of the above that the app needs in one download
+const bundle_file = "bundle.zip"
+
+// Made by `build.py --pyc-bundle`, points at a zip of bytecode imported as is
+const pyc_manifest_file = "bundle.json"
+
+async function fetch_file(file) {
+    const response = await fetch(file)
+    if (!response.ok) {
+        return null
+    }
+    return new Uint8Array(await response.arrayBuffer())
 }
 
-for (const file of local_deps) {
-    await load_file(file)
+async function fetch_files(files) {
+    const contents = await Promise.all(files.map(fetch_file))
+    return new Map(files.map((file, i) => [file, contents[i]]))
 }
 
-const app_resolvers = [
-    "app.py",
-    "app.pyx",
-]
+function write_files(files) {
+    for (const [file, data] of files) {
+        if (data === null) {
+            continue
+        }
+        const directory = file.substring(0, file.lastIndexOf("/"))
+        if (directory) {
+            pyodide.FS.mkdirTree(directory)
+        }
+        pyodide.FS.writeFile(file, data)
+    }
+}
 
-let resolved = false
-let use_pyx = false
+async function fetch_sources() {
+    const bundle = await fetch_file(bundle_file)
+    return bundle ? {bundle} : {files: await fetch_files([...runtime_files, ...app_files])}
+}
 
-for (const file of app_resolvers) {
-    const result = await load_file(file)
-    if (result) {
-        resolved = true
-        if (file.endsWith("pyx")) {
-            use_pyx = true
+async function fetch_pyc_bundle() {
+    // The manifest changes with every build, the bundle it names never does
+    const response = await fetch(pyc_manifest_file, {cache: "no-cache"})
+    if (!response.ok) {
+        return null
+    }
+    const manifest = await response.json()
+    const data = await fetch_file(manifest.bundle)
+    return data && {manifest, data}
+}
+
+// Everything is downloaded at once, while Pyodide itself is loading
+let [loaded_pyodide, sources] = await Promise.all([
+    loadPyodide(),
+    fetch_pyc_bundle().then(async (pyc) => pyc ? {pyc} : await fetch_sources()),
+])
+window.pyodide = loaded_pyodide
+
+if (sources.pyc) {
+    const {manifest, data} = sources.pyc
+    const python = pyodide.runPython("import sys; sys.implementation.cache_tag")
+    if (python === manifest.python) {
+        const path = `${pyodide.FS.cwd()}/${manifest.bundle}`
+        pyodide.FS.writeFile(path, data)
+        // zipimport loads the bytecode straight from the archive
+        pyodide.pyimport("sys").path.insert(0, path)
+    } else {
+        console.warn(`${manifest.bundle} was compiled for ${manifest.python}, not ${python}, loading the sources instead`)
+        sources = await fetch_sources()
+    }
+}
+
+if (sources.bundle) {
+    pyodide.unpackArchive(sources.bundle, "zip")
+} else if (sources.files) {
+    for (const file of runtime_files) {
+        if (sources.files.get(file) === null) {
+            throw Error(`Missing ${file}!`)
         }
-        break
     }
+    write_files(sources.files)
 }
 
-if (!resolved) {
+const has_file = (file) => pyodide.FS.analyzePath(file).exists
+const precompiled = !sources.bundle && !sources.files
+
+if (!precompiled && !has_file("app.py") && !has_file("app.pyx")) {
     throw Error("Missing app!")
 }
 
-const tinyhtml = pyodide.pyimport("tinyhtml")
-window.gen_callback = tinyhtml.gen_callback
-window.callbacks = tinyhtml.callbacks
-
 let main_source = `
 from app import App
 app = App()
@@ -89,15 +125,58 @@ app.render_root()
 app
 `
 
-if (use_pyx) {
-    for (const file of pyx_deps) {
-        await load_file(file)
-    }
+if (!precompiled && !has_file("app.py")) {
+    // Transpiling in the browser, install the parser while fetching its files
+    const install = pyodide.loadPackage("micropip").then(() => {
+        const micropip = pyodide.pyimport("micropip")
+        return Promise.all(parser_packages.map((name) => micropip.install(name)))
+    })
+    const [, files] = await Promise.all([install, fetch_files(parser_files)])
+    write_files(files)
     main_source = `import pydom_parser\n` + main_source
 }
 
+const tinyhtml = pyodide.pyimport("tinyhtml")
+window.gen_callback = tinyhtml.gen_callback
+window.callbacks = tinyhtml.callbacks
+
+// Events are delegated to a single listener per event type on #root, which
+// collects the data-h ids from the target up and hands them to Python at once
+const root = document.getElementById("root")
+const pydom = pyodide.pyimport("pydom")
+const non_bubbling = new Set(["focus", "blur", "mouseenter", "mouseleave", "load", "error", "scroll"])
+const delegated = new Set()
+
+window.pyDomDelegate = (type) => {
+    if (delegated.has(type)) {
+        return
+    }
+    delegated.add(type)
+    const bubbles = !non_bubbling.has(type)
+    root.addEventListener(type, (event) => {
+        const idents = []
+        let node = event.target
+        while (node && node !== root) {
+            if (node.dataset && node.dataset.h !== undefined) {
+                idents.push(node.dataset.h)
+            }
+            node = bubbles ? node.parentNode : null
+        }
+        if (idents.length) {
+            pydom.dispatch(type, idents, event)
+        }
+    }, !bubbles)
+}
+
+// Load the page with ?profile to record renders, then call pyDomProfile() from the console
+if (new URLSearchParams(location.search).has("profile")) {
+    const profiler = pyodide.pyimport("profiler")
+    profiler.enable()
+    window.pyDomProfile = () => profiler.print_summary()
+}
+
 window.app = await pyodide.runPythonAsync(main_source)
 
 addEventListener("resize", (event) => {
     app.render_tree()
-});
\ No newline at end of file
+});
@@ -1,11 +1,16 @@
-import random
+import inspect
+import itertools
 import string
-from functools import partial
+import time
+from inspect import signature
 from typing import List
 
-import js
-
-from tinyhtml import h, _h, AttrDict
+import backend
+import profiler
+import scheduler
+import vdom
+from scheduler import batch, flush_sync
+from tinyhtml import h, _h, AttrDict, callbacks, tag_factory, frag, template, css_number
 
 
 class BuiltinElement(h):
@@ -13,57 +18,659 @@ class BuiltinElement(h):
         return h(__name, **attrs)
 
 
-button = partial(BuiltinElement, "button")
-div = partial(BuiltinElement, "div")
-h6 = partial(BuiltinElement, "h6")
-h5 = partial(BuiltinElement, "h5")
-h4 = partial(BuiltinElement, "h4")
-h3 = partial(BuiltinElement, "h3")
-h2 = partial(BuiltinElement, "h2")
-h1 = partial(BuiltinElement, "h1")
-a = partial(BuiltinElement, "a")
-span = partial(BuiltinElement, "span")
-p = partial(BuiltinElement, "p")
-main = partial(BuiltinElement, "main")
+button = tag_factory("button")
+div = tag_factory("div")
+h6 = tag_factory("h6")
+h5 = tag_factory("h5")
+h4 = tag_factory("h4")
+h3 = tag_factory("h3")
+h2 = tag_factory("h2")
+h1 = tag_factory("h1")
+a = tag_factory("a")
+span = tag_factory("span")
+p = tag_factory("p")
+main = tag_factory("main")
+
+
+#
+#   Event delegation
+#
+
+
+def _delegate(event_type):
+    backend.current.listen(event_type)
+
+
+callbacks.on_event_type = _delegate
+
+_takes_event = {}
+
+
+def _handler_code(handler):
+    """The code object deciding the signature of ``handler``, None if there's none to key on"""
+    func = getattr(handler, "__func__", handler)
+    code = getattr(func, "__code__", None)
+    if code is None:
+        # Callable instances, all of a class share its __call__
+        code = getattr(getattr(type(handler), "__call__", None), "__code__", None)
+    return code
+
+
+def _call_handler(handler, event):
+    # Keyed on code objects, as bound methods and lambdas are recreated every render,
+    # and handlers without one (partials, builtins) are inspected each time instead of
+    # piling up in the cache
+    code = _handler_code(handler)
+    takes_event = _takes_event.get(code) if code is not None else None
+    if takes_event is None:
+        try:
+            takes_event = any(
+                param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD, param.VAR_POSITIONAL)
+                for param in signature(handler).parameters.values()
+            )
+        except (TypeError, ValueError):
+            takes_event = False
+        if code is not None:
+            _takes_event[code] = takes_event
+    return handler(event) if takes_event else handler()
+
+
+def dispatch(event_type, idents, event=None):
+    """Runs the handlers for ``event_type`` of the tags with the given data-h ids, innermost first
+
+    What they update renders on the next frame, ahead of any background rendering.
+    """
+    with scheduler.urgent_updates():
+        for ident in idents:
+            handlers = callbacks.get(int(ident))
+            if not isinstance(handlers, dict):
+                continue
+            handler = handlers.get(event_type)
+            if handler is None:
+                continue
+            _call_handler(handler, event)
+            if getattr(event, "cancelBubble", False):
+                break
+
+
+#
+#   Server side rendering
+#
+
+# Set on #root by pages rendered ahead of time, whose markup is then hydrated
+# rather than replaced
+SSR_ATTRIBUTE = "data-ssr"
+
+
+def render_to_string(element) -> str:
+    """Renders ``element`` to html, which ``render_root`` takes over once loaded in the browser
+
+    Works without a document, such as under plain CPython on a server.
+    """
+    html = vdom.to_html([element.to_vnode()])
+    if profiler.enabled:
+        profiler.emitted(element, html)
+    return html
+
+
+# Ids are given out in order, so an app built the same way on the server and in
+# the browser gets the same ids, which hydrating then doesn't have to rewrite
+_element_ids = itertools.count(1)
 
+# Elements currently building their virtual tree, innermost last, along with
+# the state each of them has read so far
+_rendering = []
+_tracking = []
 
-class Element(_h):
+# Props evaluated in the current render pass, with the state they read
+_prop_values = {}
+
+
+class Props(AttrDict):
+    """The props of an Element, calling the lambdas props arrive as at most once per render pass
+
+    A pass starts whenever an Element renders outside of any other. Within it,
+    whoever reads a prop again gets the same value, and depends on the same state.
+    """
+
+    def __getattribute__(self, item):
+        if dict.__contains__(self, item):
+            return Props.get(self, item)
+        return super().__getattribute__(item)
+
+    def get(self, key):
+        value = dict.get(self, key)
+        if not callable(value) or inspect.ismethod(value):
+            return value
+        if not _tracking:
+            return value()
+        cached = _prop_values.get((id(self), key))
+        if cached is not None:
+            _tracking[-1].update(cached[2])
+            return cached[1]
+        _tracking.append({})
+        try:
+            value = value()
+        finally:
+            deps = _tracking.pop()
+            _tracking[-1].update(deps)
+        _prop_values[(id(self), key)] = (self, value, deps)
+        return value
+
+
+def _same_props(old: Props, new: Props) -> bool:
+    """Whether the props compare equal one by one, only evaluated up to the first that doesn't"""
+    if dict.keys(old) != dict.keys(new):
+        return False
+    for key in new:
+        old_value, new_value = old.get(key), new.get(key)
+        if old_value is not new_value and old_value != new_value:
+            return False
+    return True
+
+
+class _ElementType(type(_h)):
+    def __call__(cls, *args, **attrs):
+        if not (cls.memo and _rendering):
+            return super().__call__(*args, **attrs)
+        # Elements with memo are looked up among those constructed by the same
+        # render the last time, by key or by order of construction
+        parent = _rendering[-1]
+        constructed = parent._memo_current
+        if constructed is None:
+            constructed = {}
+            object.__setattr__(parent, "_memo_current", constructed)
+        props = Props(attrs)
+        key = props.get("key")
+        if key is None:
+            # How many were constructed without a key so far is kept under (cls,)
+            count = constructed.get((cls,), 0)
+            constructed[(cls,)] = count + 1
+            key = (cls, None, count)
+        else:
+            key = (cls, "key", key)
+        previous = parent._memo_previous.get(key)
+        if previous is not None and _same_props(previous._memo_props, props):
+            element = previous
+        else:
+            element = super().__call__(*args, **attrs)
+            object.__setattr__(element, "_memo_props", props)
+        constructed[key] = element
+        return element
+
+
+class Element(_h, metaclass=_ElementType):
     first_render = False
+    # Reuse the last render of this element while the state it read is unchanged.
+    # Turn off for elements whose render reads state living outside of Elements.
+    memoize = True
+    _vnode = None
+    _vnode_deps = None
+    _html = None
+    _html_deps = None
+    _parent = None
+    _callback_ids = ()
+    _props = None
+    # Reuse the instance constructed at the same place by the last render, state and
+    # all, rather than constructing another, when given props that compare equal
+    memo = False
+    _memo_props = None
+    _memo_current = None
+    _memo_previous = {}
+    # Set while an ``async def build_children`` runs, and to what it raised
+    loading = False
+    load_error = None
 
     def __init__(self, *, _class='div', **attrs):
+        object.__setattr__(self, "_versions", {})
         super().__init__(
-            BuiltinElement(_class, **attrs, id=''.join(random.choices(string.ascii_lowercase, k=8))),
+            h(_class, **attrs, id=f"pydom-{next(_element_ids)}"),
             tuple()
         )
-        self.build_children(AttrDict(attrs))
+        props = Props(attrs)
+        object.__setattr__(self, "_props", props)
+        if inspect.iscoroutinefunction(self.build_children):
+            self.build_placeholder(props)
+            self.load()
+        else:
+            self.build_children(props)
 
     def build_children(self, attrs):
         self.children = [
 
         ]
 
+    def build_placeholder(self, attrs):
+        """The children shown while an ``async def build_children`` hasn't finished"""
+        self.children = []
+
+    def build_error(self, attrs, error):
+        """The children shown once an ``async def build_children`` raised ``error``, re-raises by default"""
+        raise error
+
+    def load(self):
+        """Runs an ``async def build_children`` (again) on the event loop, returns its task
+
+        The children stay as they are until it sets them. Without a running loop,
+        nothing happens and this returns None, ``await element.reload()`` instead.
+        """
+        coroutine = self.reload()
+        task = backend.current.create_task(coroutine)
+        if task is None:
+            coroutine.close()
+        else:
+            self.loading = True
+        return task
+
+    async def reload(self):
+        """Awaits an ``async def build_children``, the change of children re-renders the element"""
+        self.loading = True
+        self.load_error = None
+        try:
+            await self.build_children(self._props)
+        except Exception as error:
+            self.load_error = error
+            self.build_error(self._props, error)
+        finally:
+            self.loading = False
+
+    def __getattribute__(self, key):
+        if _tracking and key[0] != "_":
+            versions = object.__getattribute__(self, "_versions")
+            _tracking[-1][(id(self), key)] = (self, key, versions.get(key, 0))
+        return object.__getattribute__(self, key)
+
     def __setattr__(self, key, value):
         if getattr(self, key, None) != value:
             fr = self.first_render
             super().__setattr__(key, value)
+            versions = self._versions
+            versions[key] = versions.get(key, 0) + 1
             if fr:
-                self.render_tree()
+                if profiler.enabled:
+                    profiler.trigger(self, key)
+                scheduler.schedule(self)
+
+    def invalidate(self):
+        """Forces a re-render, for changes the element can't see such as mutated lists"""
+        object.__setattr__(self, "_vnode_deps", None)
+        object.__setattr__(self, "_html_deps", None)
+        if self.first_render:
+            if profiler.enabled:
+                profiler.trigger(self, "invalidate()")
+            scheduler.schedule(self)
+
+    def unmount(self):
+        """Called once the element has been removed from the document"""
+        callbacks.release_all(self._callback_ids)
+        object.__setattr__(self, "_callback_ids", ())
+        object.__setattr__(self, "_vnode", None)
+        object.__setattr__(self, "_vnode_deps", None)
+        object.__setattr__(self, "first_render", False)
+
+    def ancestors(self):
+        parent = self._parent
+        while parent is not None:
+            yield parent
+            parent = parent._parent
+
+    @staticmethod
+    def _is_fresh(deps) -> bool:
+        return deps is not None and all(
+            element._versions.get(key, 0) == version for element, key, version in deps.values()
+        )
+
+    def _enter(self):
+        if _rendering:
+            object.__setattr__(self, "_parent", _rendering[-1])
+        else:
+            _prop_values.clear()
+        _rendering.append(self)
+        _tracking.append({})
+        callbacks.open_scope(self._callback_ids)
+
+    def _exit(self):
+        _rendering.pop()
+        if self._memo_previous or self._memo_current is not None:
+            object.__setattr__(self, "_memo_previous", self._memo_current or {})
+            object.__setattr__(self, "_memo_current", None)
+        object.__setattr__(self, "_callback_ids", callbacks.close_scope())
+        deps = _tracking.pop()
+        if _tracking:
+            # What the element read is also read by whoever renders it
+            _tracking[-1].update(deps)
+        return deps
+
+    def _reuse(self, deps) -> bool:
+        if not (self.memoize and self._is_fresh(deps)):
+            return False
+        if _rendering:
+            object.__setattr__(self, "_parent", _rendering[-1])
+        if _tracking:
+            _tracking[-1].update(deps)
+        if profiler.enabled:
+            profiler.reused(self)
+        return True
+
+    def _build_vnode(self):
+        profiling = profiler.enabled
+        if profiling:
+            profiler.render_started(self)
+        self._enter()
+        try:
+            node = vdom.build_element(self, component=self)
+        finally:
+            object.__setattr__(self, "_vnode_deps", self._exit())
+            if profiling:
+                profiler.render_finished(self)
+        return node
+
+    def to_vnode(self):
+        if self._vnode is not None and self._reuse(self._vnode_deps):
+            return self._vnode
+        node = self._build_vnode()
+        object.__setattr__(self, "first_render", True)
+        object.__setattr__(self, "_vnode", node)
+        return node
 
     def render_root(self):
         if not self.first_render:
             self.first_render = True
-        div = js.document.getElementById('root')
-        html = self.render()
-        div.innerHTML = html
+        root = backend.document().getElementById('root')
+        node = self.to_vnode()
+        start = time.perf_counter()
+        if root.getAttribute(SSR_ATTRIBUTE) is not None:
+            # Keep the markup rendered on the server, only attach to it
+            root.removeAttribute(SSR_ATTRIBUTE)
+            vdom.hydrate_children(root, [node], check_attrs=True)
+            html = None
+        else:
+            html = vdom.mount(root, [node])
+        if profiler.enabled:
+            profiler.patched(self, time.perf_counter() - start)
+            if html is not None:
+                profiler.emitted(self, html)
+
+    def descendants(self):
+        """The Elements in the children of this one, innermost first
+
+        Only those present in the children as they are, the ones made by lambdas
+        while rendering aren't known until then.
+        """
+        found = []
+        stack = list(self.children)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Element):
+                found.append(node)
+                stack.extend(node.children)
+            elif isinstance(node, (_h, frag)):
+                stack.extend(node.children)
+            elif isinstance(node, template):
+                stack.extend(node.slots)
+            elif isinstance(node, (list, tuple)):
+                stack.extend(node)
+        # Reversed, every Element comes after the ones inside it
+        return reversed(found)
+
+    def render_steps(self):
+        """Renders the out of date Elements inside this one, one per step, leaving render_tree little to do
+
+        Used by the scheduler to render a large tree a slice at a time, nothing is
+        committed to the document until render_tree.
+        """
+        for element in self.descendants():
+            # Those not memoized would render again in render_tree anyway
+            if element.memoize and (element._vnode is None or not element._is_fresh(element._vnode_deps)):
+                element.to_vnode()
+                yield
 
     def render_tree(self):
         if not self.first_render:
             self.first_render = True
-        ident = self.tag.attrs.get('id')
-        div = js.document.getElementById(ident)
-        html = self.render()
-        div.innerHTML = html
+        old = self._vnode
+        new = self._build_vnode()
+        dom = None
+        if old is None or old.dom is None:
+            dom = backend.document().getElementById(self.tag.attrs.get('id'))
+        start = time.perf_counter()
+        object.__setattr__(self, "_vnode", vdom.update(old, new, dom))
+        if profiler.enabled:
+            profiler.patched(self, time.perf_counter() - start)
+        # Ancestors hold this node updated in place, so their trees are still current
+        for ancestor in self.ancestors():
+            if ancestor._vnode_deps is not None:
+                ancestor._vnode_deps.update(self._vnode_deps)
 
     def render_into(self, builder: List[str]) -> None:
-        super().render_into(builder)
+        if self._html is not None and self._reuse(self._html_deps):
+            builder.append(self._html)
+            return
+        fragment = []
+        profiling = profiler.enabled
+        if profiling:
+            profiler.render_started(self)
+        self._enter()
+        try:
+            super().render_into(fragment)
+        finally:
+            object.__setattr__(self, "_html_deps", self._exit())
+            if profiling:
+                profiler.render_finished(self)
+        html = "".join(fragment)
+        if profiling:
+            profiler.emitted(self, html)
+        object.__setattr__(self, "_html", html)
+        builder.append(html)
         self.first_render = True
+
+
+#
+#   Windowed lists
+#
+
+
+class _FixedRowHeights:
+    def __init__(self, count, height):
+        self.count = count
+        self.height = height
+
+    def set(self, index, height) -> bool:
+        return False
+
+    def offset(self, index) -> float:
+        return index * self.height
+
+    def index_at(self, y) -> int:
+        return min(max(int(y // self.height), 0), max(self.count - 1, 0))
+
+
+class _RowHeights:
+    """Heights of rows, measured or estimated, with their prefix sums in a Fenwick tree
+
+    Updating a height and finding the row at some offset are both O(log n), so the
+    heights of a huge list can be refined as its rows get measured.
+    """
+
+    def __init__(self, count, estimate):
+        self.count = count
+        self.heights = [estimate] * count
+        tree = [0] * (count + 1)
+        for i in range(1, count + 1):
+            tree[i] += estimate
+            parent = i + (i & -i)
+            if parent <= count:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def set(self, index, height) -> bool:
+        delta = height - self.heights[index]
+        if not delta:
+            return False
+        self.heights[index] = height
+        i = index + 1
+        while i <= self.count:
+            self.tree[i] += delta
+            i += i & -i
+        return True
+
+    def offset(self, index) -> float:
+        """The sum of the heights of the rows before ``index``"""
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def index_at(self, y) -> int:
+        """The row covering offset ``y``"""
+        position = 0
+        step = 1 << self.count.bit_length()
+        while step:
+            following = position + step
+            if following <= self.count and self.tree[following] <= y:
+                position = following
+                y -= self.tree[following]
+            step >>= 1
+        return min(position, max(self.count - 1, 0))
+
+
+def _render_text(item, index):
+    return str(item)
+
+
+def _resolve(prop):
+    """Props written in pyx arrive as lambdas without arguments, evaluated on each render"""
+    code = getattr(prop, "__code__", None)
+    if code is not None and code.co_argcount == 0 and not code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS):
+        return prop()
+    return prop
+
+
+def _px(value) -> str:
+    # Offsets of long lists are large floats, which must not end up in exponent notation
+    return f"{css_number(value)}px"
+
+
+class VirtualList(Element):
+    """Renders only the rows of ``items`` in view, plus ``overscan`` rows on either side
+
+    ``render_item(item, index)`` renders a row. Rows are ``row_height`` pixels
+    high, or with ``variable_height`` that is only an estimate, refined by measuring
+    the rows as they are shown. The list scrolls within ``height`` pixels.
+
+    Scrolling only re-renders the list once the rows in view change, and rows
+    scrolled out of view are patched into the rows scrolled in rather than replaced.
+    Assign ``items`` a new sequence to change them.
+
+        <VirtualList items={self.lines} render_item={self.render_line} row_height={18}/>
+    """
+    # The (start, end) range of rows rendered, None until the list is first scrolled
+    window = None
+
+    def __init__(self, *, items=(), render_item=_render_text, row_height=24, height=400, overscan=5,
+                 variable_height=False, **attrs):
+        # Kept off the tag, unlike the props of other elements
+        super().__init__(**attrs)
+        self.items = items
+        self.render_item = render_item
+        self.row_height = row_height
+        self.height = height
+        self.overscan = overscan
+        self.variable_height = variable_height
+        object.__setattr__(self, "_heights", None)
+        object.__setattr__(self, "_heights_of", None)
+        # Rows are keyed by a slot, which rows scrolled out of view hand over to those scrolled in
+        object.__setattr__(self, "_slots", {})
+        object.__setattr__(self, "_scroll_top", 0)
+
+    def build_children(self, props):
+        self.children = [
+            div(_class="pyx-virtual-list", onscroll=lambda: self.on_scroll,
+                style=lambda: {"height": _px(self.prop("height")), "overflow-y": "auto"})(
+                div(style=lambda: {"height": _px(self._row_heights().offset(len(self.prop("items")))),
+                                   "position": "relative"})(
+                    div(style=lambda: {"transform": f"translateY({_px(self._row_heights().offset(self._window()[0]))})"})(
+                        lambda: self._rows()
+                    )
+                )
+            )
+        ]
+
+    def prop(self, name):
+        return _resolve(getattr(self, name))
+
+    def _row_heights(self):
+        items = self.prop("items")
+        if self._heights_of is not items or self._heights.count != len(items):
+            kind = _RowHeights if self.prop("variable_height") else _FixedRowHeights
+            object.__setattr__(self, "_heights", kind(len(items), self.prop("row_height")))
+            object.__setattr__(self, "_heights_of", items)
+        return self._heights
+
+    def visible_window(self, scroll_top, viewport_height):
+        """The ``(start, end)`` range of rows to render at this scroll position"""
+        count = len(self.prop("items"))
+        if not count:
+            return 0, 0
+        heights = self._row_heights()
+        overscan = self.prop("overscan")
+        first = heights.index_at(scroll_top)
+        last = heights.index_at(scroll_top + viewport_height) + 1
+        return max(first - overscan, 0), min(last + overscan, count)
+
+    def _window(self):
+        window = self.window
+        if window is None or window[1] > len(self.prop("items")):
+            window = self.visible_window(self._scroll_top, self.prop("height"))
+        return window
+
+    def _assign_slots(self, start, end):
+        previous = self._slots
+        slots = {index: previous[index] for index in range(start, end) if index in previous}
+        free = [slot for index, slot in previous.items() if index not in slots]
+        following = max(previous.values(), default=-1) + 1
+        for index in range(start, end):
+            if index not in slots:
+                if free:
+                    slots[index] = free.pop()
+                else:
+                    slots[index] = following
+                    following += 1
+        object.__setattr__(self, "_slots", slots)
+        return slots
+
+    def _rows(self):
+        start, end = self._window()
+        slots = self._assign_slots(start, end)
+        items, render_item = self.prop("items"), self.prop("render_item")
+        if self.prop("variable_height"):
+            return [
+                div(key=slots[index], _class="pyx-virtual-row", data_index=index)(render_item(items[index], index))
+                for index in range(start, end)
+            ]
+        style = {"height": _px(self.prop("row_height"))}
+        return [
+            div(key=slots[index], _class="pyx-virtual-row", data_index=index, style=style)(
+                render_item(items[index], index)
+            )
+            for index in range(start, end)
+        ]
+
+    def measure(self, rows) -> bool:
+        """Records the heights of rendered rows, returns True if any changed"""
+        heights = self._row_heights()
+        changed = False
+        for row in rows:
+            index = row.getAttribute("data-index")
+            if index is not None and int(index) < heights.count:
+                changed |= heights.set(int(index), row.offsetHeight)
+        return changed
+
+    def on_scroll(self, event):
+        viewport = event.target
+        object.__setattr__(self, "_scroll_top", viewport.scrollTop)
+        if self.prop("variable_height") and self.measure(viewport.firstChild.firstChild.childNodes):
+            # The spacer and the offset of the rows depend on the heights
+            self.invalidate()
+        self.window = self.visible_window(viewport.scrollTop, viewport.clientHeight or self.prop("height"))
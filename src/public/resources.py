@@ -0,0 +1,111 @@
+"""Loading data for Elements: shared requests, cached for a while
+
+    user = await resources.fetch(f"/api/users/{user_id}")
+
+Concurrent fetches of the same url share one request, and its result is kept
+for ``ttl`` seconds, so components showing the same data don't each load it.
+Failures aren't cached. Requests go through the ``fetch`` of the current
+backend, unless another is plugged in with ``set_fetch``, such as a
+``StubFetch`` answering without network in tests:
+
+    resources.set_fetch(resources.StubFetch({"/api/users/1": {"name": "Ada"}}))
+"""
+import asyncio
+import json
+import time
+
+import backend
+
+# Seconds results are reused for, unless fetched with another ttl
+DEFAULT_TTL = 60.0
+
+_fetch = None
+
+
+def set_fetch(fetch) -> None:
+    """Sends requests through ``async fetch(url, **options)``, None goes back to the backend's"""
+    global _fetch
+    _fetch = fetch
+
+
+class StubFetch:
+    """Answers requests from ``responses``, a dict of url to result, without network
+
+    A result can also be a function of ``(url, **options)``, or an exception to
+    raise. Every url requested is appended to ``calls``.
+    """
+
+    def __init__(self, responses, delay: float = 0.0):
+        self.responses = dict(responses)
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, url, **options):
+        self.calls.append(url)
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if url not in self.responses:
+            raise LookupError(f"no stub response for {url}")
+        response = self.responses[url]
+        if isinstance(response, BaseException):
+            raise response
+        if callable(response):
+            response = response(url, **options)
+        return response
+
+
+class ResourceCache:
+    """Results of loaders by key, kept for a time to live, loading each key once at a time"""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._results = {}
+        self._pending = {}
+
+    def peek(self, key, default=None):
+        """The result cached for ``key`` if still fresh, without loading it"""
+        result = self._results.get(key)
+        if result is None or result[0] <= self.clock():
+            return default
+        return result[1]
+
+    def __contains__(self, key) -> bool:
+        result = self._results.get(key)
+        return result is not None and result[0] > self.clock()
+
+    async def get(self, key, loader, ttl: float = None):
+        """The result for ``key``, from the cache, a load in progress, or ``await loader()``"""
+        result = self._results.get(key)
+        if result is not None and result[0] > self.clock():
+            return result[1]
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.ensure_future(self._load(key, loader, ttl))
+        # A waiter being cancelled doesn't cancel the load the others wait for
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader, ttl):
+        try:
+            value = await loader()
+        finally:
+            del self._pending[key]
+        self._results[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        return value
+
+    def invalidate(self, key=None) -> None:
+        """Forgets the result for ``key``, or every result, loads in progress still finish"""
+        if key is None:
+            self._results.clear()
+        else:
+            self._results.pop(key, None)
+
+
+cache = ResourceCache()
+
+
+async def fetch(url: str, ttl: float = None, **options):
+    """The body of ``url``, fetched once for every caller within ``ttl`` seconds"""
+    key = url if not options else (url, json.dumps(options, sort_keys=True, default=str))
+    send = _fetch or backend.current.fetch
+    return await cache.get(key, lambda: send(url, **options), ttl)
@@ -0,0 +1,191 @@
+"""Coalesces Element updates so each one re-renders at most once per frame.
+
+Elements are marked dirty when their state changes and are flushed together on
+the next animation frame. Outside of a browser, the flush happens on the next
+turn of the running asyncio loop, or when ``flush_sync`` is called.
+
+Updates made while handling user input are urgent and flushed that way. Others,
+from timers or fetches say, render in the background: a slice at a time, each
+taking at most ``SLICE_BUDGET`` seconds before giving the browser its turn (on
+``requestIdleCallback``, or the next turn of the asyncio loop), so rendering a
+large tree doesn't freeze the page. The Elements nested in a background update
+render first, one per step, then the update itself is committed to the document
+at once, reusing their renders. Urgent updates go ahead of the slices left.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+
+import backend
+
+# Flushing re-renders, which may dirty more elements; give up on runaway cycles
+MAX_FLUSH_PASSES = 100
+
+# Render updates not made by user input a slice at a time, False renders them
+# all on the next frame like urgent ones
+TIME_SLICING = True
+# Seconds a slice may take before yielding, half a frame at 60 fps
+SLICE_BUDGET = 0.008
+
+_dirty = {}
+_batch_depth = 0
+_flush_requested = False
+
+_urgent_depth = 0
+_background = {}
+_background_steps = None
+_slice_requested = False
+
+
+def schedule(element, urgent=None) -> None:
+    """Marks ``element`` to be re-rendered on the next flush
+
+    Unless ``urgent`` says otherwise, updates are urgent while handling user
+    input (see ``urgent_updates``) and rendered in the background otherwise.
+    """
+    if urgent is None:
+        urgent = _urgent_depth > 0 or not TIME_SLICING
+    if urgent:
+        _background.pop(id(element), None)
+        _dirty[id(element)] = element
+        if not _batch_depth:
+            _request_flush()
+    elif id(element) not in _dirty:
+        _background[id(element)] = element
+        if not _batch_depth:
+            _request_slice()
+
+
+def pending() -> int:
+    return len(_dirty) + len(_background)
+
+
+@contextmanager
+def urgent_updates():
+    """Makes the updates scheduled inside render on the next frame, ``pydom.dispatch`` runs handlers in it"""
+    global _urgent_depth
+    _urgent_depth += 1
+    try:
+        yield
+    finally:
+        _urgent_depth -= 1
+
+
+def _request_flush() -> None:
+    global _flush_requested
+    if _flush_requested:
+        return
+
+    if not backend.current.request_animation_frame(lambda timestamp: _flush_urgent()):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop to defer to, updates wait for an explicit flush_sync()
+            return
+        loop.call_soon(_flush_urgent)
+    _flush_requested = True
+
+
+def _request_slice() -> None:
+    global _slice_requested
+    if _slice_requested:
+        return
+
+    if not backend.current.request_idle_callback(lambda deadline: run_slice()):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Background updates wait for flush_sync() too
+            return
+        loop.call_soon(run_slice)
+    _slice_requested = True
+
+
+def _flush_urgent() -> None:
+    global _flush_requested
+    _flush_requested = False
+
+    passes = 0
+    while _dirty:
+        passes += 1
+        if passes > MAX_FLUSH_PASSES:
+            _dirty.clear()
+            raise RuntimeError("elements kept updating each other while rendering")
+
+        dirty = dict(_dirty)
+        _dirty.clear()
+        for element in dirty.values():
+            # Re-rendering an ancestor already re-renders this element
+            if not any(id(ancestor) in dirty for ancestor in element.ancestors()):
+                element.render_tree()
+
+
+def _steps():
+    """The background updates, one step of rendering at a time"""
+    while _background:
+        element = next(iter(_background.values()))
+        if any(id(ancestor) in _background for ancestor in element.ancestors()):
+            # Committing the ancestor renders this element too
+            del _background[id(element)]
+            continue
+        render_steps = getattr(element, "render_steps", None)
+        if render_steps is not None:
+            yield from render_steps()
+        # Unless it was made urgent and rendered already in the meantime
+        if _background.pop(id(element), None) is not None:
+            element.render_tree()
+        yield
+
+
+def _step_through(budget=None) -> None:
+    global _background_steps
+    if _background_steps is None:
+        _background_steps = _steps()
+    end = None if budget is None else time.perf_counter() + budget
+    try:
+        for _ in _background_steps:
+            if end is not None and (time.perf_counter() >= end or _dirty):
+                return
+    except BaseException:
+        _background_steps = None
+        raise
+    _background_steps = None
+
+
+def run_slice(budget=None) -> None:
+    """Renders urgent updates, then background ones for up to ``budget`` seconds (``SLICE_BUDGET``)"""
+    global _slice_requested
+    _slice_requested = False
+    _flush_urgent()
+    _step_through(SLICE_BUDGET if budget is None else budget)
+    if _background:
+        _request_slice()
+
+
+async def flush_async(budget=None) -> None:
+    """Renders every pending update a slice at a time, yielding to the asyncio loop in between"""
+    while _dirty or _background:
+        run_slice(budget)
+        await asyncio.sleep(0)
+
+
+def flush_sync() -> None:
+    """Re-renders every dirty element right away, background updates included"""
+    _flush_urgent()
+    while _background:
+        _step_through()
+        _flush_urgent()
+
+
+@contextmanager
+def batch():
+    """Defers re-rendering until the outermost batch exits, then flushes once"""
+    global _batch_depth
+    _batch_depth += 1
+    try:
+        yield
+    finally:
+        _batch_depth -= 1
+    if not _batch_depth and (_dirty or _background):
+        flush_sync()
@@ -13,21 +13,24 @@ __version__ = "1.2.0"  # Remember to update setup.py
 __author__ = "Niklas Fiekas"
 __all__ = [
     "Frag", "SupportsRender", "Attribute",
-    "render_into", "render",
-    "h", "raw", "frag", "html",
+    "render_into", "render", "render_iter",
+    "h", "raw", "frag", "html", "template", "tag_factory",
 ]
 
 import abc
+import itertools
+import re
+import sys
+from decimal import Decimal
+from functools import lru_cache
 from html import escape
 from inspect import ismethod
-from typing import Union, Dict, Iterable, List, Tuple
-
-import cssutils
-
-cssutils.ser.prefs.useMinified()
+from typing import Union, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 class Frag(abc.ABC):
+    __slots__ = ()
+
     @abc.abstractmethod
     def render_into(self, builder: List[str]) -> None:
         ...
@@ -44,47 +47,235 @@ class Frag(abc.ABC):
 SupportsRender = Union[str, int, Frag, None, Iterable[Union[str, int, Frag, None]]]
 
 
+class _Markup(str):
+    """Html put on the render stack, appended as is rather than escaped"""
+    __slots__ = ()
+
+
+@lru_cache(maxsize=None)
+def _closing_tag(name: str) -> _Markup:
+    return _Markup(f"</{name}>")
+
+
+@lru_cache(maxsize=None)
+def _opening_tag(name: str) -> _Markup:
+    return _Markup(f"<{name}>")
+
+
+@lru_cache(maxsize=256)
+def _template_chunks(chunks: Tuple[str, ...]) -> Tuple[_Markup, ...]:
+    return tuple(_Markup(chunk) for chunk in chunks)
+
+
+def _render_stack(stack: list, builder: List[str], limit: Optional[int] = None) -> None:
+    """Renders what's on ``stack``, rightmost first
+
+    Plain tags, fragments and iterables are expanded onto the stack instead of
+    recursing, so the depth of a tree isn't bounded by the recursion limit.
+    Other Frags, such as components, still render themselves. With a ``limit``,
+    this stops once ``builder`` holds about that many strings, leaving the rest
+    on the stack.
+    """
+    pop = stack.pop
+    push = stack.append
+    append = builder.append
+    while stack:
+        node = pop()
+        cls = type(node)
+        if cls is _Markup:
+            append(node)
+            continue
+        if cls is str:
+            append(escape(node, quote=False))
+            continue
+        if callable(node):
+            node = node()
+            cls = type(node)
+        if node is None:
+            continue
+        elif cls is str:
+            append(escape(node, quote=False))
+        elif cls is _h:
+            tag = node.tag
+            children = node.children
+            if tag is not None:
+                tag.render_into(builder)
+                if len(children) == 1 and type(children[0]) is str:
+                    # Tags holding just some text are too common to go through the stack
+                    append(escape(children[0], quote=False))
+                    append(_closing_tag(tag.name))
+                    continue
+                push(_closing_tag(tag.name))
+            stack.extend(reversed(children))
+            if limit is not None and len(builder) >= limit:
+                return
+        elif cls is raw:
+            append(node.html)
+        elif cls is template:
+            chunks = node.chunks
+            slots = node.slots
+            append(chunks[0])
+            for i, slot in enumerate(slots, 1):
+                if callable(slot):
+                    slot = slot()
+                if type(slot) is str:
+                    append(escape(slot, quote=False))
+                    append(chunks[i])
+                    continue
+                # Anything but text goes through the stack, and so does the rest of the template
+                markup = _template_chunks(chunks)
+                for j in range(len(slots), i, -1):
+                    push(markup[j])
+                    push(slots[j - 1])
+                push(markup[i])
+                push(slot)
+                break
+        elif cls is frag:
+            stack.extend(reversed(node.children))
+        elif isinstance(node, str):
+            append(escape(node, quote=False))
+        elif isinstance(node, Frag):
+            node.render_into(builder)
+        elif isinstance(node, bytes):
+            raise TypeError(f"cannot render bytes as html: {node!r}")
+        elif hasattr(node, "__iter__"):
+            stack.extend(reversed(list(node)))  # type: ignore
+        else:
+            append(escape(str(node), quote=False))
+
+
 def render_into(frag: SupportsRender, builder: List[str]) -> None:
-    if callable(frag):
-        frag = frag()
-    if frag is None:
-        return
-    elif isinstance(frag, str):
-        builder.append(escape(frag, quote=False))
-    elif isinstance(frag, Frag):
-        frag.render_into(builder)
-    elif isinstance(frag, bytes):
-        raise TypeError(f"cannot render bytes as html: {frag!r}")
-    elif hasattr(frag, "__iter__"):
-        for c in frag:  # type: ignore
-            render_into(c, builder)
-    else:
-        builder.append(escape(str(frag), quote=False))
+    _render_stack([frag], builder)
 
 
 def render(frag: SupportsRender) -> str:
     builder: List[str] = []
-    render_into(frag, builder)
+    _render_stack([frag], builder)
     return "".join(builder)
 
 
+def render_iter(frag: SupportsRender, chunk_parts: int = 1024) -> Iterator[str]:
+    """Renders ``frag`` piece by piece, joining about ``chunk_parts`` strings into each chunk
+
+    Meant for streaming large pages to a socket or a file without holding all of
+    their html in memory.
+    """
+    stack = [frag]
+    builder: List[str] = []
+    while stack:
+        _render_stack(stack, builder, chunk_parts)
+        if builder:
+            yield "".join(builder)
+            builder.clear()
+
+
 Attribute = Union[str, int, bool, Iterable[Union[str, int, None]], Dict[str, bool], None]
 
 
-class h(Frag):
-    def __init__(self, __name: str, **attrs: Attribute) -> None:
+def render_attr_into(attr: str, value: str, builder: List[str]) -> None:
+    # Attribute name is normalized/validated in constructor.
+    builder.append(" ")
+    builder.append(attr)
+
+    # Attribute value syntax:
+    # https://www.w3.org/TR/html52/syntax.html#elements-attributes
+    if value:
+        # Double-quoted attribute value syntax. No need to escape
+        # single quotes, as quote=True would do:
+        # https://github.com/python/cpython/blob/v3.9.0/Lib/html/__init__.py#L12-L25
+        builder.append("=\"")
+        builder.append(escape(value, quote=False).replace("\"", "&quot;"))
+        builder.append("\"")
+    # If the value is an empty string, use empty attribute syntax.
+
+
+# Tag names already validated, interned so that every tag of a kind shares its name
+_tag_names: Dict[str, str] = {}
+_MAX_TAG_NAMES = 1024
+
+
+def _tag_name(name: str) -> str:
+    interned = _tag_names.get(name)
+    if interned is None:
         # See "Tag name" in
         # https://www.w3.org/TR/html52/syntax.html#writing-html-documents-elements.
-        if not (__name and __name.isascii() and __name.isalnum()):
-            raise ValueError(f"invalid html tag: {__name!r}")
-        self.name = __name
+        if not (name and name.isascii() and name.isalnum()):
+            raise ValueError(f"invalid html tag: {name!r}")
+        interned = sys.intern(name)
+        if len(_tag_names) < _MAX_TAG_NAMES:
+            _tag_names[interned] = interned
+    return interned
 
-        self.attrs = attrs
 
-    def render_into(self, builder: List[str]) -> None:
-        builder.append("<")
-        builder.append(self.name)
-        for attr, value in self.attrs.items():
+def _compact_attrs(attrs: Dict[str, Attribute]):
+    # Most tags have no attribute or a single one, which don't need a dict of their own
+    if not attrs:
+        return None
+    if len(attrs) == 1:
+        for item in attrs.items():
+            return item
+    return attrs
+
+
+class h(Frag):
+    """A tag, with its attributes stored as None, a single (name, value) pair or a dict"""
+    __slots__ = ("name", "_attrs")
+
+    def __init__(self, __name: str, **attrs: Attribute) -> None:
+        self.name = _tag_name(__name)
+        self._attrs = _compact_attrs(attrs)
+
+    @property
+    def attrs(self) -> Dict[str, Attribute]:
+        """The attributes of the tag, a copy for tags with less than two of them"""
+        attrs = self._attrs
+        if attrs is None:
+            return {}
+        if type(attrs) is tuple:
+            return dict((attrs,))
+        return attrs
+
+    @attrs.setter
+    def attrs(self, attrs: Dict[str, Attribute]) -> None:
+        self._attrs = _compact_attrs(attrs)
+
+    def _attr_items(self):
+        attrs = self._attrs
+        if attrs is None:
+            return ()
+        if type(attrs) is tuple:
+            return (attrs,)
+        return attrs.items()
+
+    @property
+    def key(self):
+        # Identifies the node among its siblings when diffing virtual trees.
+        attrs = self._attrs
+        if attrs is None:
+            return None
+        if type(attrs) is tuple:
+            key = attrs[1] if attrs[0] == "key" else None
+        else:
+            key = attrs.get("key")
+        if callable(key):
+            key = key()
+        return key
+
+    def iter_attrs(self) -> Iterator[Tuple[str, str]]:
+        events = None
+        for attr, value in self._attr_items():
+            if attr == "key":
+                # Keys only identify siblings for diffing and are never rendered.
+                continue
+            if attr[:2] == "on" and callable(value):
+                value = value()
+                if callable(value):
+                    # Event handlers are dispatched by a single listener on the
+                    # document, which finds them through the data-h attribute.
+                    if events is None:
+                        events = {}
+                    events[attr[2:].lower()] = value
+                    continue
             attr, value = _normalize_attr(attr, value)
             if value is False or value is None:
                 # Falsy boolean attributes are omitted altogether:
@@ -110,29 +301,43 @@ class h(Frag):
             else:
                 value = str(value)
 
-            # Attribute name is normalized/validated in constructor.
-            builder.append(" ")
-            builder.append(attr)
+            yield attr, value
 
-            # Attribute value syntax:
-            # https://www.w3.org/TR/html52/syntax.html#elements-attributes
-            if not value:
-                # If the value is an empty string, use empty attribute syntax.
-                continue
-            else:
-                # Double-quoted attribute value syntax. No need to escape
-                # single quotes, as quote=True would do:
-                # https://github.com/python/cpython/blob/v3.9.0/Lib/html/__init__.py#L12-L25
-                builder.append("=\"")
-                builder.append(escape(value, quote=False).replace("\"", "&quot;"))
-                builder.append("\"")
+        if events is not None:
+            yield "data-h", str(callbacks.register_events(events))
+
+    def render_into(self, builder: List[str]) -> None:
+        if self._attrs is None:
+            builder.append(_opening_tag(self.name))
+            return
+        builder.append("<")
+        builder.append(self.name)
+        for attr, value in self.iter_attrs():
+            render_attr_into(attr, value, builder)
         builder.append(">")
 
     def __call__(self, *children: SupportsRender) -> _h:
         return _h(self, children)
 
 
+def tag_factory(name: str) -> Callable[..., h]:
+    """Makes ``h(name, **attrs)`` tags, checking ``name`` once rather than for every tag"""
+    name = _tag_name(name)
+    new = object.__new__
+
+    def factory(**attrs: Attribute) -> h:
+        tag = new(h)
+        tag.name = name
+        tag._attrs = _compact_attrs(attrs)
+        return tag
+
+    factory.__name__ = factory.__qualname__ = name
+    return factory
+
+
 class _h(Frag):
+    __slots__ = ("tag", "children")
+
     def __init__(self, tag: h, children: Tuple[SupportsRender, ...]) -> None:
         self.tag = tag
         self.children = children
@@ -140,8 +345,7 @@ class _h(Frag):
     def render_into(self, builder: List[str]) -> None:
         if self.tag is not None:
             self.tag.render_into(builder)
-        for child in self.children:
-            render_into(child, builder)
+        render_into(self.children, builder)
 
         if self.tag is not None:
             builder.append("</")
@@ -150,6 +354,8 @@ class _h(Frag):
 
 
 class raw(Frag):
+    __slots__ = ("html",)
+
     def __init__(self, html: str) -> None:
         self.html = html
 
@@ -157,16 +363,35 @@ class raw(Frag):
         builder.append(self.html)
 
 
+class template(Frag):
+    """Markup compiled ahead of time by the transpiler
+
+    ``chunks`` are static, already escaped html, and each of ``slots`` is rendered
+    between two of them.
+    """
+    __slots__ = ("chunks", "slots")
+
+    def __init__(self, chunks: Tuple[str, ...], slots: Tuple[SupportsRender, ...]) -> None:
+        self.chunks = chunks
+        self.slots = slots
+
+    def render_into(self, builder: List[str]) -> None:
+        render_into(self, builder)
+
+
 class frag(Frag):
+    __slots__ = ("children",)
+
     def __init__(self, *children: SupportsRender):
         self.children = children
 
     def render_into(self, builder: List[str]) -> None:
-        for child in self.children:
-            render_into(child, builder)
+        render_into(self.children, builder)
 
 
 class html(h):
+    __slots__ = ()
+
     def __init__(self, **attrs: Attribute) -> None:
         super().__init__("html", **attrs)
 
@@ -175,21 +400,186 @@ class html(h):
         super().render_into(builder)
 
 
-def convert_style(value: dict):
-    rule = cssutils.css.CSSStyleDeclaration()
-    for key, value in value.items():
-        rule.setProperty(key, value)
-
-    return rule.cssText
-
-
-# callbacks = weakref.WeakValueDictionary()
-callbacks = dict()
+# Run styles through cssutils, which reports invalid properties and values but is
+# slow to import and to run
+VALIDATE_STYLES = False
+
+# Properties taking plain numbers, others get numbers in pixels
+UNITLESS_PROPERTIES = frozenset({
+    "animation-iteration-count", "aspect-ratio", "border-image-outset", "border-image-slice",
+    "border-image-width", "column-count", "columns", "fill-opacity", "flex", "flex-grow", "flex-shrink",
+    "flood-opacity", "font-weight", "grid-area", "grid-column", "grid-column-end", "grid-column-start",
+    "grid-row", "grid-row-end", "grid-row-start", "line-clamp", "line-height", "opacity", "order", "orphans",
+    "scale", "stop-opacity", "stroke-dasharray", "stroke-dashoffset", "stroke-miterlimit", "stroke-opacity",
+    "stroke-width", "tab-size", "widows", "z-index", "zoom",
+})
+
+_PROPERTY_NAME = re.compile(r"(--[\w-]+|-?[a-z][a-z0-9-]*)")
+_UPPERCASE = re.compile(r"[A-Z]")
+# Characters which would end the declaration or the rule, escaped so they can't
+_VALUE_ESCAPES = str.maketrans({";": "\\;", "{": "\\{", "}": "\\}", "\n": "\\a ", "\r": "\\d "})
+
+_cssutils = None
+
+
+@lru_cache(maxsize=512)
+def css_property_name(name: str) -> str:
+    """fontSize, font_size and font-size all give font-size, WebkitTransition gives -webkit-transition"""
+    if name.startswith("--"):
+        # Custom properties are case sensitive
+        return name
+    name = _UPPERCASE.sub(lambda match: "-" + match.group().lower(), name.replace("_", "-"))
+    if not _PROPERTY_NAME.fullmatch(name):
+        raise ValueError(f"invalid css property name: {name!r}")
+    return name
+
+
+def css_number(value: Union[int, float]) -> str:
+    """``value`` in fixed-point notation, which CSS requires, with all of its digits"""
+    if isinstance(value, int):
+        return str(value)
+    # repr has the fewest digits that round trip, Decimal writes them without an exponent
+    number = format(Decimal(repr(value)), "f")
+    if "." in number:
+        number = number.rstrip("0").rstrip(".")
+    return "0" if number == "-0" else number
+
+
+def css_value(name: str, value) -> Optional[str]:
+    if value is None or value is False:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value == 0 or name in UNITLESS_PROPERTIES or name.startswith("--"):
+            return css_number(value)
+        return f"{css_number(value)}px"
+    return str(value).strip().translate(_VALUE_ESCAPES)
+
+
+@lru_cache(maxsize=1024)
+def _serialize_style(items: Tuple[Tuple[str, object], ...]) -> str:
+    declarations = []
+    for name, value in items:
+        name = css_property_name(name)
+        value = css_value(name, value)
+        if value is not None and value != "":
+            declarations.append(f"{name}:{value}")
+    return ";".join(declarations)
+
+
+def _validate_style(css: str) -> str:
+    global _cssutils
+    if _cssutils is None:
+        import cssutils
+        cssutils.ser.prefs.useMinified()
+        _cssutils = cssutils
+    return _cssutils.css.CSSStyleDeclaration(cssText=css).cssText
+
+
+def convert_style(value, validate: Optional[bool] = None) -> str:
+    """Serializes a dict of css properties into the value of a style attribute
+
+    Serializations are cached by the dict's items, so a style rendered over and
+    over is only serialized once. ``validate`` (``VALIDATE_STYLES`` by default)
+    additionally goes through cssutils.
+    """
+    if isinstance(value, str):
+        css = value
+    else:
+        items = tuple(value.items())
+        try:
+            css = _serialize_style(items)
+        except TypeError:  # Unhashable values, can't be cached
+            css = _serialize_style.__wrapped__(items)
+    if VALIDATE_STYLES if validate is None else validate:
+        css = _validate_style(css)
+    return css
+
+
+class CallbackRegistry:
+    """Maps the handler ids rendered into markup back to Python callables
+
+    An id either stands for a single callable, or for the table of event
+    handlers of one tag, keyed by event type.
+
+    Renders can be grouped into scopes, handing back the ids the previous render
+    of the same scope used. Ids are then reused in the order handlers are
+    registered, so rendering the same tree again replaces its handlers rather
+    than adding new ones, and the ids of handlers no longer rendered are
+    released. Handlers registered outside of any scope live until released.
+    """
+
+    def __init__(self):
+        self._callbacks = {}
+        self._ids = itertools.count(1)
+        self._scopes = []
+        self.peak = 0
+        self.registered = 0
+        self.released = 0
+        self.event_types = set()
+        # Called with each event type the first time a handler is registered for it
+        self.on_event_type = None
+
+    def register(self, callback) -> int:
+        if self._scopes:
+            previous, ids = self._scopes[-1]
+            ident = previous[len(ids)] if len(ids) < len(previous) else next(self._ids)
+            ids.append(ident)
+        else:
+            ident = next(self._ids)
+
+        if ident not in self._callbacks:
+            self.registered += 1
+        self._callbacks[ident] = callback
+        if len(self._callbacks) > self.peak:
+            self.peak = len(self._callbacks)
+        return ident
+
+    def register_events(self, handlers: Dict[str, callable]) -> int:
+        for event_type in handlers:
+            if event_type not in self.event_types:
+                self.event_types.add(event_type)
+                if self.on_event_type is not None:
+                    self.on_event_type(event_type)
+        return self.register(handlers)
+
+    def get(self, ident, default=None):
+        return self._callbacks.get(ident, default)
+
+    def release(self, ident) -> None:
+        if self._callbacks.pop(ident, None) is not None:
+            self.released += 1
+
+    def release_all(self, idents: Iterable[int]) -> None:
+        for ident in idents:
+            self.release(ident)
+
+    def open_scope(self, previous: Tuple[int, ...] = ()) -> None:
+        """Starts collecting the ids of handlers, reusing those of ``previous`` first"""
+        self._scopes.append((previous, []))
+
+    def close_scope(self) -> Tuple[int, ...]:
+        """Releases the ids of the previous render left unused, and returns the current ones"""
+        previous, ids = self._scopes.pop()
+        self.release_all(previous[len(ids):])
+        return tuple(ids)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "live": len(self._callbacks),
+            "peak": self.peak,
+            "registered": self.registered,
+            "released": self.released,
+        }
+
+    def __len__(self):
+        return len(self._callbacks)
+
+
+callbacks = CallbackRegistry()
 
 
 def convert_function(value: callable):
-    target = id(value)
-    callbacks[target] = value
+    target = callbacks.register(value)
     return f"gen_callback({target})()"
 
 
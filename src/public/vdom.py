@@ -0,0 +1,450 @@
+"""A lightweight virtual DOM built from tinyhtml trees.
+
+Trees of ``h``/``_h`` objects are turned into ``VNode``/``VText`` trees, which
+are diffed against the previously rendered tree. Only the differences are
+applied to the live document, instead of re-parsing a whole subtree through
+``innerHTML``.
+"""
+
+from bisect import bisect_left
+from functools import lru_cache
+from html import escape
+from html.parser import HTMLParser
+from typing import List, Optional, Sequence, Tuple
+
+import backend
+from tinyhtml import Frag, _h, raw, frag, template, render_attr_into
+
+# Elements which never have children or a closing tag
+VOID_ELEMENTS = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+})
+
+ELEMENT_NODE = 1
+TEXT_NODE = 3
+
+# Marks where the slots of a template go in its markup, escaped text can't contain it
+SLOT_MARKER = "pyx-slot"
+_SLOT = object()
+
+
+class VNode:
+    __slots__ = ("tag", "attrs", "children", "key", "dom", "component")
+
+    def __init__(self, tag: str, attrs: dict, children: Optional[list], key=None, component=None):
+        self.tag = tag
+        self.attrs = attrs
+        # None marks a void element, which has no closing tag
+        self.children = children
+        self.key = key
+        self.dom = None
+        self.component = component
+
+    def __repr__(self):
+        return f"VNode({self.tag!r}, {self.attrs!r}, {self.children!r})"
+
+
+class VText:
+    __slots__ = ("text", "dom")
+    key = None
+    tag = None
+
+    def __init__(self, text: str):
+        self.text = text
+        self.dom = None
+
+    def __repr__(self):
+        return f"VText({self.text!r})"
+
+
+#
+#   Building virtual trees
+#
+
+
+def build(node) -> list:
+    """Builds the list of virtual nodes a renderable expands to"""
+    out = []
+    build_into(node, out)
+    return out
+
+
+def build_into(node, out: list) -> None:
+    if callable(node):
+        node = node()
+    if node is None:
+        return
+    elif isinstance(node, str):
+        _append_text(node, out)
+    elif isinstance(node, Frag):
+        to_vnode = getattr(node, "to_vnode", None)
+        if to_vnode is not None:
+            out.append(to_vnode())
+        elif isinstance(node, _h):
+            if node.tag is None:
+                for child in node.children:
+                    build_into(child, out)
+            else:
+                out.append(build_element(node))
+        elif isinstance(node, raw):
+            for child in _instantiate(parse_html(node.html)):
+                _append_node(child, out)
+        elif isinstance(node, template):
+            for child in _instantiate(parse_template(node.chunks), iter(node.slots)):
+                _append_node(child, out)
+        elif isinstance(node, frag):
+            for child in node.children:
+                build_into(child, out)
+        else:
+            # Unknown fragment types still know how to render themselves
+            for child in _instantiate(parse_html(node.render())):
+                _append_node(child, out)
+    elif isinstance(node, bytes):
+        raise TypeError(f"cannot render bytes as html: {node!r}")
+    elif hasattr(node, "__iter__"):
+        for child in node:
+            build_into(child, out)
+    else:
+        _append_text(str(node), out)
+
+
+def build_element(node: _h, component=None) -> VNode:
+    children = []
+    for child in node.children:
+        build_into(child, children)
+    return VNode(node.tag.name, dict(node.tag.iter_attrs()), children, node.tag.key, component)
+
+
+def _append_text(text: str, out: list) -> None:
+    # Adjacent strings become a single text node once parsed by the browser,
+    # merge them so the virtual tree lines up with the real one
+    if not text:
+        return
+    if out and isinstance(out[-1], VText):
+        out[-1] = VText(out[-1].text + text)
+    else:
+        out.append(VText(text))
+
+
+def _append_node(node, out: list) -> None:
+    if isinstance(node, VText):
+        _append_text(node.text, out)
+    else:
+        out.append(node)
+
+
+class _HTMLTreeParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = ("", (), [])
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        node = (tag, tuple((k, v or "") for k, v in attrs), None if tag in VOID_ELEMENTS else [])
+        self.stack[-1][2].append(node)
+        if node[2] is not None:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self.stack[-1][2].append((tag, tuple((k, v or "") for k, v in attrs), None if tag in VOID_ELEMENTS else []))
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i][0] == tag:
+                del self.stack[i:]
+                break
+
+    def handle_data(self, data):
+        self.stack[-1][2].append(data)
+
+    def handle_comment(self, data):
+        if data == SLOT_MARKER:
+            self.stack[-1][2].append(_SLOT)
+
+
+@lru_cache(maxsize=256)
+def parse_html(html: str) -> Tuple:
+    """Parses raw markup into an immutable description, shared between all uses of the same string"""
+    parser = _HTMLTreeParser()
+    parser.feed(html)
+    parser.close()
+
+    def freeze(node):
+        if isinstance(node, str) or node is _SLOT:
+            return node
+        tag, attrs, children = node
+        return tag, attrs, None if children is None else tuple(freeze(c) for c in children)
+
+    return freeze(parser.root)[2]
+
+
+@lru_cache(maxsize=256)
+def parse_template(chunks: Tuple[str, ...]) -> Tuple:
+    return parse_html(f"<!--{SLOT_MARKER}-->".join(chunks))
+
+
+def _instantiate(description: Sequence, slots=None) -> List:
+    out = []
+    for node in description:
+        if isinstance(node, str):
+            _append_text(node, out)
+        elif node is _SLOT:
+            build_into(next(slots), out)
+        else:
+            tag, attrs, children = node
+            out.append(VNode(tag, dict(attrs), None if children is None else _instantiate(children, slots)))
+    return out
+
+
+#
+#   Serializing
+#
+
+
+def to_html(nodes: Sequence) -> str:
+    builder: List[str] = []
+    for node in nodes:
+        _html_into(node, builder)
+    return "".join(builder)
+
+
+def _html_into(node, builder: List[str]) -> None:
+    if isinstance(node, VText):
+        builder.append(escape(node.text, quote=False))
+        return
+    builder.append("<")
+    builder.append(node.tag)
+    for attr, value in node.attrs.items():
+        render_attr_into(attr, value, builder)
+    builder.append(">")
+    if node.children is not None:
+        for child in node.children:
+            _html_into(child, builder)
+        builder.append("</")
+        builder.append(node.tag)
+        builder.append(">")
+
+
+#
+#   Applying to the document
+#
+
+
+def create(node):
+    """Creates the real DOM for a virtual node"""
+    if isinstance(node, VText):
+        node.dom = backend.document().createTextNode(node.text)
+        return node.dom
+
+    dom = backend.document().createElement(node.tag)
+    for attr, value in node.attrs.items():
+        dom.setAttribute(attr, value)
+    for child in node.children or ():
+        dom.appendChild(create(child))
+    node.dom = dom
+    return dom
+
+
+def mount(container, nodes: Sequence) -> str:
+    """Replaces the content of ``container`` with ``nodes``, returns the markup it was given
+
+    The markup is assigned in one go, then the virtual nodes are attached to the
+    DOM the browser built from it.
+    """
+    html = to_html(nodes)
+    container.innerHTML = html
+    hydrate_children(container, nodes)
+    return html
+
+
+def hydrate(node, dom, check_attrs: bool = False) -> bool:
+    """Attaches ``node`` to an existing DOM node, returns False if they don't match
+
+    Text is always brought up to date, attributes only when ``check_attrs`` is set,
+    as markup we just generated ourselves can't disagree with the tree.
+    """
+    if dom is None:
+        return False
+    if isinstance(node, VText):
+        if dom.nodeType != TEXT_NODE:
+            return False
+        if dom.textContent != node.text:
+            dom.textContent = node.text
+        node.dom = dom
+        return True
+
+    if dom.nodeType != ELEMENT_NODE or dom.tagName.lower() != node.tag:
+        return False
+    node.dom = dom
+    if check_attrs:
+        for attr, value in node.attrs.items():
+            if dom.getAttribute(attr) != value:
+                dom.setAttribute(attr, value)
+        for attr in list(dom.getAttributeNames()):
+            if attr not in node.attrs:
+                dom.removeAttribute(attr)
+    if node.children is not None:
+        hydrate_children(dom, node.children, check_attrs)
+    return True
+
+
+def hydrate_children(parent, children: Sequence, check_attrs: bool = False) -> None:
+    child_nodes = parent.childNodes
+    if child_nodes.length == len(children):
+        for i, child in enumerate(children):
+            dom = child_nodes.item(i)
+            if not hydrate(child, dom, check_attrs):
+                parent.replaceChild(create(child), dom)
+    else:
+        # The markup was reinterpreted by the browser (e.g. an implicit <tbody>),
+        # so build these children by hand instead
+        parent.textContent = ""
+        for child in children:
+            parent.appendChild(create(child))
+
+
+def update(old, new, dom=None):
+    """Brings the DOM of ``old`` up to date with ``new``, and returns the live node
+
+    ``old`` is updated in place rather than swapped for ``new``, so trees holding
+    on to it (such as the one of a parent component) stay accurate. If ``old``
+    isn't attached to the document, ``dom`` is the node to hydrate or replace.
+    """
+    if old is None or old.dom is None:
+        if dom is None:
+            raise RuntimeError("nothing to update, the node was never rendered into the document")
+        if not hydrate(new, dom, check_attrs=True):
+            dom.parentNode.replaceChild(create(new), dom)
+        return new
+
+    patch(old, new)
+    old.attrs, old.children, old.key = new.attrs, new.children, new.key
+    return old
+
+
+def unmount(node) -> None:
+    """Lets the components of a subtree removed from the document clean up after themselves"""
+    if isinstance(node, VText):
+        return
+    if node.component is not None:
+        node.component.unmount()
+    for child in node.children or ():
+        unmount(child)
+
+
+def _same(old, new) -> bool:
+    if isinstance(old, VText) or isinstance(new, VText):
+        return isinstance(old, VText) and isinstance(new, VText)
+    return (
+        old.tag == new.tag and
+        old.key == new.key and
+        (old.children is None) == (new.children is None)
+    )
+
+
+def patch(old, new) -> None:
+    """Applies the difference between ``old`` and ``new`` to the DOM ``old`` is attached to"""
+    if old is new:
+        return
+    dom = new.dom = old.dom
+
+    if isinstance(new, VText):
+        if old.text != new.text:
+            dom.textContent = new.text
+        return
+
+    # Another instance now renders this node, such as an Element constructed anew
+    # by every render of its parent, the old one is gone from the document
+    if old.component is not None and old.component is not new.component:
+        old.component.unmount()
+
+    old_attrs, new_attrs = old.attrs, new.attrs
+    for attr, value in new_attrs.items():
+        if old_attrs.get(attr) != value:
+            dom.setAttribute(attr, value)
+    for attr in old_attrs:
+        if attr not in new_attrs:
+            dom.removeAttribute(attr)
+
+    if new.children is not None:
+        patch_children(dom, old.children, new.children)
+
+
+def patch_children(parent, old_children: Sequence, new_children: Sequence) -> None:
+    if old_children is new_children:
+        return
+
+    # Text-only content is a very common case, skip the bookkeeping below
+    if (
+            len(old_children) == len(new_children) == 1 and
+            isinstance(old_children[0], VText) and isinstance(new_children[0], VText)
+    ):
+        patch(old_children[0], new_children[0])
+        return
+
+    keyed = {child.key: child for child in old_children if child.key is not None}
+    unkeyed = [child for child in old_children if child.key is None]
+    unkeyed_index = 0
+
+    # Pair each new child with the old node it replaces, if any
+    pairs = []
+    reused = set()
+    for new in new_children:
+        if new.key is not None:
+            old = keyed.pop(new.key, None)
+        elif unkeyed_index < len(unkeyed):
+            old = unkeyed[unkeyed_index]
+            unkeyed_index += 1
+        else:
+            old = None
+
+        if old is not None and _same(old, new):
+            patch(old, new)
+            reused.add(id(old))
+            pairs.append((new, old))
+        else:
+            create(new)
+            pairs.append((new, None))
+
+    live = []
+    for old in old_children:
+        if id(old) in reused:
+            live.append(old)
+        else:
+            parent.removeChild(old.dom)
+            unmount(old)
+
+    # Move and insert nodes so the DOM follows the new order. The reused nodes
+    # already in the right order relative to each other stay where they are, going
+    # backwards every other node goes right before the node following it.
+    position = {id(old): i for i, old in enumerate(live)}
+    staying = _longest_increasing([position[id(old)] for _, old in pairs if old is not None])
+    ref = None
+    for new, old in reversed(pairs):
+        if old is None or position[id(old)] not in staying:
+            parent.insertBefore(new.dom, ref)
+        ref = new.dom
+
+
+def _longest_increasing(values: Sequence[int]) -> set:
+    """The values of a longest increasing subsequence of distinct ``values``"""
+    tails = []  # The smallest last value of increasing subsequences of each length
+    tail_indices = []
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        length = bisect_left(tails, value)
+        if length:
+            previous[i] = tail_indices[length - 1]
+        if length == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[length] = value
+            tail_indices[length] = i
+    result = set()
+    i = tail_indices[-1] if tail_indices else -1
+    while i >= 0:
+        result.add(values[i])
+        i = previous[i]
+    return result